@@ -0,0 +1,69 @@
+"""
+Compares the rows/sec of the NDJSON bulk serializer used by upload_dataframe
+against the previous path, which transposed the batch into one dictionary
+per row and left the JSON encoding to the Elasticsearch client.
+
+    python benchmarks/bulk_serialization.py
+"""
+
+import json
+import os
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.curdir)))
+
+from dsio.restream.elastic import serialize_dataframe, bulk_bodies
+
+
+def make_batch(n_rows, n_sensors):
+    """ A scored batch, shaped like the ones the restream pipeline
+        uploads """
+    data = {'time': 1500000000000 + 1000*np.arange(n_rows, dtype=np.int64)}
+    for i in range(n_sensors):
+        sensor = 'sensor_%d' % i
+        data[sensor] = np.random.normal(0, 1, n_rows)
+        data['SCORE_%s' % sensor] = np.random.uniform(0, 1, n_rows)
+        data['FLAG_%s' % sensor] = data['SCORE_%s' % sensor] > 0.99
+    return pd.DataFrame(data)
+
+
+def dict_path(dataframe, index_name='bench', entry_type='measurement'):
+    """ The previous upload_dataframe body construction """
+    dataframe = dataframe.copy()
+    dataframe.insert(1, '_index', index_name)
+    dataframe.insert(1, '_type', entry_type)
+    actions = tuple(dataframe.fillna(0).T.to_dict().values())
+    lines = []
+    for action in actions: # what elasticsearch.helpers.bulk does per row
+        meta = {'index': {'_index': action.pop('_index'),
+                          '_type': action.pop('_type')}}
+        lines.append(json.dumps(meta))
+        lines.append(json.dumps(action, default=float))
+    return '\n'.join(lines) + '\n'
+
+
+def ndjson_path(dataframe, index_name='bench', entry_type='measurement'):
+    action = json.dumps({"index": {"_index": index_name, "_type": entry_type}})
+    return list(bulk_bodies(serialize_dataframe(dataframe), action))
+
+
+def main(repeat=3):
+    print('{:>8} {:>8} {:>16} {:>16} {:>9}'.format(
+        'rows', 'sensors', 'dicts (rows/s)', 'ndjson (rows/s)', 'speedup'))
+    for n_rows in [100, 1000, 10000]:
+        for n_sensors in [1, 10, 100]:
+            batch = make_batch(n_rows, n_sensors)
+            old = min(timeit.repeat(lambda: dict_path(batch),
+                                    number=1, repeat=repeat))
+            new = min(timeit.repeat(lambda: ndjson_path(batch),
+                                    number=1, repeat=repeat))
+            print('{:>8} {:>8} {:>16.0f} {:>16.0f} {:>8.1f}x'.format(
+                n_rows, n_sensors, n_rows/old, n_rows/new, old/new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Per-call overhead of the built-in detectors at small batch sizes
+
+Live sources score a handful of rows at a time, where the fixed cost of a
+call matters more than the per-row one. For every built-in detector, set up
+as the restreamer sets it up (see init_detector_models), times score_and_flag
+and update on float64 batches of 1, 10, 100 and 10000 rows, and reports the
+time per call and per row.
+
+    python benchmarks/call_overhead.py [--sensors 4] [--filter Gaussian]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.curdir)))
+
+from dsio.anomaly_detectors import (
+    Gaussian1D, Percentile1D, PercentileSketch1D, LOF1D, Mahalanobis
+)
+from dsio.helpers import init_detector_models
+
+DETECTORS = [Gaussian1D, Percentile1D, PercentileSketch1D, LOF1D, Mahalanobis]
+BATCH_SIZES = [1, 10, 100, 10000]
+
+
+def time_call(function, repeat):
+    """ Best time per call, in seconds """
+    number, _ = timeit.Timer(function).autorange()
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sensors', type=int, default=4)
+    parser.add_argument('--training-size', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--filter', default='',
+                        help='Only time the detectors whose name contains this')
+    args = parser.parse_args()
+
+    sensors = ['sensor_%d' % i for i in range(args.sensors)]
+    rng = np.random.default_rng(0)
+    training_set = rng.normal(size=(args.training_size, args.sensors))
+
+    print('{:<20} {:<15} {:>7} {:>12} {:>12}'.format(
+        'detector', 'call', 'rows', 'us/call', 'ns/row'))
+    for detector in DETECTORS:
+        if args.filter not in detector.__name__:
+            continue
+        for batch_size in BATCH_SIZES:
+            batch = rng.normal(size=(batch_size, args.sensors))
+            model = init_detector_models(sensors, training_set, detector)
+            for call in ['score_and_flag', 'update']:
+                seconds = time_call(lambda: getattr(model, call)(batch),
+                                    args.repeat)
+                print('{:<20} {:<15} {:>7} {:>12.1f} {:>12.1f}'.format(
+                    detector.__name__, call, batch_size, seconds * 1e6,
+                    seconds * 1e9 / batch_size))
+
+
+if __name__ == '__main__':
+    main()
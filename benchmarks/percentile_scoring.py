@@ -0,0 +1,53 @@
+"""
+Compares the sorted-window Percentile1D scoring path against the previous
+one, which called scipy's percentileofscore once per datapoint.
+
+    python benchmarks/percentile_scoring.py
+"""
+
+import os
+import sys
+import timeit
+
+import numpy as np
+from scipy.stats import percentileofscore
+
+sys.path.append(os.path.abspath(os.path.join(os.path.curdir)))
+
+from dsio.anomaly_detectors import Percentile1D
+from dsio.generate_data import gen_data_with_obvious_anomalies
+
+
+def score_per_point(sample, x):
+    """ The previous Percentile1D.score_anomaly """
+    return np.array([0.01*percentileofscore(sample, z) for z in x])
+
+
+def main(repeat=3):
+    print('{:>8} {:>8} {:>14} {:>14} {:>9}'.format(
+        'window', 'batch', 'per point (s)', 'sorted (s)', 'speedup'))
+    for window_size in [100, 300, 1000]:
+        for batch_size in [10, 1000, 10000]:
+            x, _ = gen_data_with_obvious_anomalies(n=window_size + batch_size)
+            detector = Percentile1D(window_size=window_size)
+            detector.fit(x[:window_size])
+            batch = x[window_size:]
+
+            # Both paths must agree exactly before we time them
+            assert np.array_equal(
+                score_per_point(detector.sample_, batch),
+                detector.score_anomaly(batch)
+            )
+
+            old = min(timeit.repeat(
+                lambda: score_per_point(detector.sample_, batch),
+                number=1, repeat=repeat))
+            new = min(timeit.repeat(
+                lambda: detector.score_anomaly(batch),
+                number=1, repeat=repeat))
+            print('{:>8} {:>8} {:>14.6f} {:>14.6f} {:>8.1f}x'.format(
+                window_size, batch_size, old, new, old/new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Accuracy and memory of PercentileSketch1D against the exact Percentile1D
+
+For windows of increasing length, both detectors summarise the same stream
+from gen_data_with_obvious_anomalies (Percentile1D with a window holding
+all of it), then score a fresh batch. Reports the bytes of state each one
+keeps, the largest and mean error of the sketch's percentile ranks, the
+fraction of flags on which they disagree, and the time taken to score.
+
+    python benchmarks/quantile_sketch.py [--relative-accuracy 0.01]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.curdir)))
+
+from dsio.anomaly_detectors import Percentile1D, PercentileSketch1D
+from dsio.generate_data import gen_data_with_obvious_anomalies
+
+
+def state_bytes(detector):
+    return sum(value.nbytes for value in detector.get_state().values())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--relative-accuracy', type=float, default=0.01)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print('{:>9} {:>12} {:>12} {:>10} {:>10} {:>9} {:>10} {:>10}'.format(
+        'window', 'exact (B)', 'sketch (B)', 'max err', 'mean err',
+        'flags', 'exact (s)', 'sketch (s)'))
+    for window_size in [1000, 10000, 100000, 1000000]:
+        x, _ = gen_data_with_obvious_anomalies(
+            n=window_size + args.batch_size,
+            anomalies=(window_size + args.batch_size) // 100
+        )
+        history, batch = x[:window_size], x[window_size:]
+
+        exact = Percentile1D(window_size=window_size)
+        exact.fit(history)
+        sketch = PercentileSketch1D(
+            relative_accuracy=args.relative_accuracy
+        )
+        sketch.fit(history)
+
+        exact_scores, exact_flags = exact.score_and_flag(batch)
+        sketch_scores, sketch_flags = sketch.score_and_flag(batch)
+        error = np.abs(np.asarray(sketch_scores) - np.asarray(exact_scores))
+        disagreement = np.mean(np.asarray(sketch_flags) !=
+                               np.asarray(exact_flags))
+
+        exact_time = min(timeit.repeat(lambda: exact.score_and_flag(batch),
+                                       number=1, repeat=args.repeat))
+        sketch_time = min(timeit.repeat(lambda: sketch.score_and_flag(batch),
+                                        number=1, repeat=args.repeat))
+        print('{:>9} {:>12} {:>12} {:>10.5f} {:>10.5f} {:>8.2%} '
+              '{:>10.5f} {:>10.5f}'.format(
+                  window_size, state_bytes(exact), state_bytes(sketch),
+                  error.max(), error.mean(), disagreement, exact_time,
+                  sketch_time))
+
+
+if __name__ == '__main__':
+    main()
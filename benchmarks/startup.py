@@ -0,0 +1,72 @@
+"""
+Guards the startup time of the dsio CLI
+
+Imports dsio.main under `python -X importtime`, reports the total import time
+and the slowest modules, and exits with an error if a backend that should be
+imported lazily is loaded at startup, or if the import exceeds the budget.
+
+    python benchmarks/startup.py [--budget SECONDS] [--top N]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+# Only needed for --es, the Bokeh dashboard, --jobs, unparsable dates or once
+# a detector is loaded (the built-in ones derive from sklearn's BaseEstimator)
+LAZY_MODULES = [
+    'bokeh', 'tornado', 'elasticsearch', 'kibana_dashboard_api', 'sklearn',
+    'scipy.stats', 'dateparser', 'multiprocessing.shared_memory',
+]
+
+
+def import_times(module='dsio.main', repeat=3):
+    """ Return {module: (self, cumulative)} import times in microseconds
+        for the fastest of repeat fresh interpreters """
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+    best = None
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+            cwd=root, stderr=subprocess.PIPE, universal_newlines=True,
+            check=True
+        )
+        times = {}
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            times[name.strip()] = (int(self_us), int(cumulative_us))
+        if best is None or times[module][1] < best[module][1]:
+            best = times
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--budget', type=float, default=1.0,
+                        help='maximum import time of dsio.main in seconds')
+    parser.add_argument('--top', type=int, default=10,
+                        help='number of slowest modules to list')
+    args = parser.parse_args()
+
+    times = import_times()
+    total = times['dsio.main'][1] / 1e6
+    print('import dsio.main: %.3fs (budget %.3fs)\n' % (total, args.budget))
+    print('{:>12}  {}'.format('self (ms)', 'module'))
+    slowest = sorted(times.items(), key=lambda item: -item[1][0])
+    for name, (self_us, _) in slowest[:args.top]:
+        print('{:>12.1f}  {}'.format(self_us / 1e3, name))
+
+    eager = sorted(name for name in times
+                   if any(name == lazy or name.startswith(lazy + '.')
+                          for lazy in LAZY_MODULES))
+    if eager:
+        print('\nImported at startup but should be lazy: %s' % ', '.join(eager))
+    if eager or total > args.budget:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+"""
+Throughput benchmarks for the detectors and the Elasticsearch serializer
+
+Synthesizes streams of several lengths and sensor counts with
+gen_data_with_obvious_anomalies, and measures the rows/sec of fit, update
+and score for Gaussian1D, Percentile1D, LOF1D and the LOF example detector,
+and of upload_dataframe against a stub bulk client that doesn't touch the
+network.
+
+Every run can be appended to a history file, tagged with the commit and
+machine it ran on, and compared against the previous run there, so that
+throughput is tracked over time:
+
+    python benchmarks/suite.py [--quick] [--save] [--compare]
+        [--history benchmarks/results.jsonl] [--filter gaussian]
+"""
+
+import argparse
+import copy
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, 'examples'))
+
+from dsio.anomaly_detectors import Gaussian1D, Percentile1D, LOF1D
+from dsio.anomaly_detectors import PerSensorDetector
+from dsio.generate_data import gen_data_with_obvious_anomalies
+from dsio.restream.elastic import upload_dataframe
+
+HISTORY = os.path.join(ROOT, 'benchmarks', 'results.jsonl')
+
+LENGTHS = [1000, 10000, 100000]
+SENSORS = [1, 10, 100]
+QUICK_LENGTHS = [1000, 10000]
+QUICK_SENSORS = [1, 10]
+
+# LOF refits a neighbour index on every call, so it gets smaller streams
+LOF_MAX_ROWS = 10000
+LOF_MAX_SENSORS = 10
+
+
+class StubBulkClient(object):
+    """ Accepts bulk requests like Elasticsearch would, without sending
+        them anywhere """
+
+    def __init__(self):
+        self.docs = 0
+        self.bytes = 0
+
+    def bulk(self, body):
+        n_docs = body.count('\n') // 2
+        self.docs += n_docs
+        self.bytes += len(body)
+        return {'errors': False,
+                'items': [{'index': {'status': 201}}] * n_docs}
+
+
+def make_stream(n_rows, n_sensors):
+    """ A (n_rows, n_sensors) stream with a few obvious anomalies per
+        sensor """
+    anomalies = max(n_rows // 100, 1)
+    return np.column_stack([
+        gen_data_with_obvious_anomalies(n=n_rows, anomalies=anomalies)[0]
+        for _ in range(n_sensors)
+    ])
+
+
+def make_batch(values):
+    """ A scored batch, shaped like the ones the restreamer uploads """
+    n_rows, n_sensors = values.shape
+    data = {'time': 1500000000000 + 1000*np.arange(n_rows, dtype=np.int64)}
+    for i in range(n_sensors):
+        sensor = 'sensor_%d' % i
+        data[sensor] = values[:, i]
+        data['SCORE_%s' % sensor] = np.random.uniform(0, 1, n_rows)
+        data['FLAG_%s' % sensor] = data['SCORE_%s' % sensor] > 0.99
+    return pd.DataFrame(data)
+
+
+def lof_detector():
+    """ The LOF example, which needs scikit-learn """
+    try:
+        from lof_anomaly_detector import LOFAnomalyDetector
+    except ImportError:
+        return None
+    return LOFAnomalyDetector
+
+
+def new_model(detector, n_sensors):
+    if detector._columnwise:
+        return detector()
+    return PerSensorDetector(detector, n_sensors)
+
+
+def best_time(func, setup, repeat):
+    """ Fastest of repeat calls of func(setup()), timing func only """
+    best = float('inf')
+    for _ in range(repeat):
+        arg = setup()
+        start = time.perf_counter()
+        func(arg)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def detector_cases(detector, lengths, sensors):
+    """ Yield (name, n_rows, func, setup) for fit, update and score of
+        detector on streams of every length and sensor count. Half of each
+        stream trains the model, the other half is the timed batch. """
+    for n_sensors in sensors:
+        for n_rows in lengths:
+            values = make_stream(2 * n_rows, n_sensors)
+            train, batch = values[:n_rows], values[n_rows:]
+            fitted = new_model(detector, n_sensors)
+            fitted.fit(train)
+            name = '%s.%%s/%d/%d' % (detector.__name__, n_rows, n_sensors)
+
+            yield (name % 'fit', n_rows,
+                   lambda model: model.fit(train),
+                   lambda: new_model(detector, n_sensors))
+            yield (name % 'update', n_rows,
+                   lambda model: model.update(batch),
+                   lambda: copy.deepcopy(fitted))
+            yield (name % 'score', n_rows,
+                   lambda model: model.score_and_flag(batch),
+                   lambda: fitted)
+
+
+def upload_cases(lengths, sensors):
+    for n_sensors in sensors:
+        for n_rows in lengths:
+            batch = make_batch(make_stream(n_rows, n_sensors))
+            yield ('upload_dataframe/%d/%d' % (n_rows, n_sensors), n_rows,
+                   lambda client: upload_dataframe(client, batch, 'bench',
+                                                   'measurement'),
+                   StubBulkClient)
+
+
+def all_cases(quick=False):
+    lengths = QUICK_LENGTHS if quick else LENGTHS
+    sensors = QUICK_SENSORS if quick else SENSORS
+    cases = [
+        detector_cases(Gaussian1D, lengths, sensors),
+        detector_cases(Percentile1D, lengths, sensors),
+        detector_cases(LOF1D, lengths, sensors),
+    ]
+    lof = lof_detector()
+    if lof is None:
+        print('scikit-learn is not installed, skipping the LOF benchmarks')
+    else:
+        cases.append(detector_cases(
+            lof, [n for n in lengths if n <= LOF_MAX_ROWS],
+            [n for n in sensors if n <= LOF_MAX_SENSORS]
+        ))
+    cases.append(upload_cases(lengths, sensors))
+    for group in cases:
+        for case in group:
+            yield case
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            stderr=subprocess.DEVNULL, universal_newlines=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_previous(path):
+    """ The last run saved in the history file, if any """
+    if not os.path.exists(path):
+        return None
+    with open(path) as history:
+        lines = [line for line in history if line.strip()]
+    return json.loads(lines[-1]) if lines else None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--quick', action='store_true',
+                        help='only run the smaller streams')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--filter', default='',
+                        help='only run benchmarks whose name contains this')
+    parser.add_argument('--history', default=HISTORY,
+                        help='JSON lines file of previous runs')
+    parser.add_argument('--save', action='store_true',
+                        help='append this run to the history file')
+    parser.add_argument('--compare', action='store_true',
+                        help='compare against the last run in the history')
+    args = parser.parse_args()
+
+    previous = load_previous(args.history) if args.compare else None
+    if args.compare and previous is None:
+        print('No previous run in %s to compare against' % args.history)
+
+    print('{:<36} {:>14} {:>10}'.format('benchmark', 'rows/sec', 'change'))
+    results = {}
+    for name, n_rows, func, setup in all_cases(args.quick):
+        if args.filter.lower() not in name.lower():
+            continue
+        try:
+            rate = n_rows / best_time(func, setup, args.repeat)
+        except Exception as exc: # report it and carry on with the others
+            print('{:<36} {:>14}  {!r}'.format(name, 'failed', exc))
+            continue
+        results[name] = rate
+
+        change = ''
+        if previous and name in previous['results']:
+            change = '{:+.1f}%'.format(
+                100 * (rate / previous['results'][name] - 1))
+        print('{:<36} {:>14.0f} {:>10}'.format(name, rate, change))
+
+    if args.save:
+        record = {
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'commit': git_revision(),
+            'machine': platform.node(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'results': results,
+        }
+        with open(args.history, 'a') as history:
+            history.write(json.dumps(record) + '\n')
+        print('\nSaved to %s' % args.history)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,25 @@
 """ Base anomaly detector class and collection of built-in detectors """
 
 import abc
-import pandas as pd
 import numpy as np
-from scipy.stats import percentileofscore
-from scipy.stats import norm
+from scipy.special import chdtr
 from collections import namedtuple
-from dsio.update_formulae import update_effective_sample_size
+from dsio.update_formulae import update_mean_variance, update_mean_covariance
 from dsio.update_formulae import (
-    convex_combination,
-    rolling_window_update,
-    decision_rule
+    RollingWindow,
+    sorted_window_edit,
+    sorted_window_update,
+    percentile_rank,
+    decision_rule,
+    gaussian_score_and_flag
 )
 
 from sklearn.base import BaseEstimator
 
 
 THRESHOLD = 0.99
+# LOF1D flags points whose local outlier factor is above 1/(1-threshold)
+LOF_THRESHOLD = 0.75
 
 
 class AnomalyMixin(object):
@@ -26,6 +29,21 @@ class AnomalyMixin(object):
     """
     _estimator_type = "anomaly"
 
+    # Detectors that set this to True accept (n_samples, n_sensors) arrays
+    # and keep independent per-column state, so a single instance can score
+    # every sensor of a batch in one pass.
+    #
+    # Detectors work on numpy arrays only: they take float64 arrays and
+    # return arrays, and trust their input instead of validating it on
+    # every call, since a stream checks its first batch once (see
+    # dsio.helpers.check_batch). That keeps the per-call cost of small
+    # batches down to the math.
+    _columnwise = False
+
+    # Detectors that set this to True model the sensors jointly, so they
+    # always get the whole (n_samples, n_sensors) array in a single process.
+    _multivariate = False
+
     def fit_score(self, X):
         """Fits the model on X and scores each datapoint in X.
 
@@ -43,6 +61,47 @@ class AnomalyMixin(object):
         self.fit(X)
         return self.score_anomaly(X)
 
+    def score_and_flag(self, X):
+        """Scores and flags each datapoint in X.
+
+        Detectors whose flags are a function of their scores should override
+        this so that X is only scored once.
+
+        Parameters
+        ----------
+        X : ndarray, shape (n_samples, ) or (n_samples, n_sensors)
+            Input data
+
+        Returns
+        -------
+        (scores, flags) : tuple of ndarrays with the same shape as X
+        """
+
+        return self.score_anomaly(X), self.flag_anomaly(X)
+
+    def get_state(self):
+        """Returns the learned state of the detector.
+
+        Following the scikit-learn convention, the learned state is every
+        public attribute whose name ends with an underscore. Columnwise
+        detectors keep the sensors on the last axis of these arrays.
+
+        Returns
+        -------
+        state : dict of ndarrays
+        """
+
+        return {
+            name: np.asarray(value) for name, value in vars(self).items()
+            if name.endswith('_') and not name.startswith('_')
+        }
+
+    def set_state(self, state):
+        """Restores state returned by get_state, without refitting."""
+
+        for name, value in state.items():
+            self.__setattr__(name, value[()] if np.ndim(value) == 0 else value)
+
     def update(self, x):
         raise NotImplementedError
 
@@ -56,6 +115,48 @@ class AnomalyMixin(object):
         raise NotImplementedError
 
 
+class PerSensorDetector(object):
+    """
+    Exposes the columnwise interface for detectors that only handle 1-D
+    input, by keeping an independent model instance for every column.
+    """
+
+    def __init__(self, detector, n_sensors):
+        self.models = [detector() for _ in range(n_sensors)]
+
+    def fit(self, X):
+        X = np.asarray(X)
+        for i, model in enumerate(self.models):
+            model.fit(X[:, i])
+
+    def update(self, X):
+        X = np.asarray(X)
+        for i, model in enumerate(self.models):
+            model.update(X[:, i])
+
+    def score_and_flag(self, X):
+        X = np.asarray(X)
+        scores = np.empty(X.shape)
+        flags = np.empty(X.shape, dtype=bool)
+        for i, model in enumerate(self.models):
+            scores[:, i], flags[:, i] = model.score_and_flag(X[:, i])
+        return scores, flags
+
+    def get_state(self):
+        """ The state of every model, stacked along a last sensor axis """
+        states = [model.get_state() for model in self.models]
+        return {
+            name: np.stack([state[name] for state in states], axis=-1)
+            for name in states[0]
+        }
+
+    def set_state(self, state):
+        for i, model in enumerate(self.models):
+            model.set_state(
+                {name: value[..., i] for name, value in state.items()}
+            )
+
+
 def compute_confusion_matrix(detector_output, index_anomalies):
 
     index_detected = set(np.where(detector_output)[0])
@@ -69,6 +170,8 @@ def compute_confusion_matrix(detector_output, index_anomalies):
 
 
 class Gaussian1D(BaseEstimator, AnomalyMixin):
+    _columnwise = True
+
     def __init__(
         self,
         ff=1.0,
@@ -81,39 +184,46 @@ class Gaussian1D(BaseEstimator, AnomalyMixin):
         self.std_ = 1
 
     def fit(self, x):
-        x = pd.Series(x)
-        self.__setattr__('mu_', np.mean(x))
-        self.__setattr__('std_', np.std(x, ddof=1))
-        self.__setattr__('ess_', len(x))
+        # missing values are left out, so each sensor counts its own sample;
+        # a sensor without any has mu_ NaN and ess_ 0, and one with a single
+        # value a std_ of 0, until update gives them more
+        x = np.asarray(x, dtype=float)
+        valid = ~np.isnan(x)
+        count = np.count_nonzero(valid, axis=0)
+        mu = np.where(valid, x, 0.0).sum(axis=0) / np.maximum(count, 1)
+        squares = (np.where(valid, x - mu, 0.0)**2).sum(axis=0)
+        self.__setattr__('mu_', np.where(count > 0, mu, np.nan))
+        self.__setattr__('std_', np.sqrt(squares / np.maximum(count - 1, 1)))
+        self.__setattr__('ess_', count)
 
     def update(self, x):  # allows mini-batch
         try:
             getattr(self, "mu_")
         except AttributeError:
             raise RuntimeError("You must fit the detector before updating it")
-        x = pd.Series(x)
-        ess, weight = update_effective_sample_size(
+        mu, var, ess = update_mean_variance(
+            mean=self.mu_,
+            variance=np.square(self.std_),
             effective_sample_size=self.ess_,
-            batch_size=len(x),
+            x=x,
             forgetting_factor=self.ff
         )
         self.__setattr__('ess_', ess)
-        self.__setattr__(
-            'mu_',
-            convex_combination(self.mu_, np.mean(x), weight=weight)
-        )
-        self.__setattr__('std_', np.std(x))
+        self.__setattr__('mu_', mu)
+        self.__setattr__('std_', np.sqrt(var))
 
     def score_anomaly(self, x):
-        x = pd.Series(x)
-        scaled_x = np.abs(x - self.mu_)/(1.0*self.std_)
-        return norm.cdf(scaled_x)
+        return self.score_and_flag(x)[0]
 
     def flag_anomaly(self, x):
-        return decision_rule(self.score_anomaly(x), self.threshold)
+        return self.score_and_flag(x)[1]
+
+    def score_and_flag(self, x):
+        return gaussian_score_and_flag(x, self.mu_, self.std_, self.threshold)
 
 
 class Percentile1D(BaseEstimator, AnomalyMixin):
+    _columnwise = True
 
     def __init__(
         self,
@@ -127,21 +237,418 @@ class Percentile1D(BaseEstimator, AnomalyMixin):
         self.sample_ = []
 
     def fit(self, x):
-        x = pd.Series(x)
-        self.__setattr__('sample_', x[:int(np.floor(self.window_size))])
+        x = np.asarray(x, dtype=float)
+        w = int(np.floor(self.window_size))
+        self.__setattr__('sample_', RollingWindow.from_array(x[:w], w))
+        self.__setattr__('sorted_sample_', np.sort(x[:w], axis=0))
 
     def update(self, x):  # allows mini-batch
-        x = pd.Series(x)
-        window = rolling_window_update(
-            old=self.sample_, new=x,
-            w=int(np.floor(self.window_size))
+        x = np.asarray(x, dtype=float)
+        w = int(np.floor(self.window_size))
+        # sample_ is in arrival order, so the oldest points are evicted
+        evicted = self.sample_.append(x)
+        if len(x) >= w:
+            sorted_window = np.sort(np.asarray(self.sample_), axis=0)
+        else:
+            sorted_window = sorted_window_update(
+                self.sorted_sample_, evicted, x
+            )
+        self.__setattr__('sorted_sample_', sorted_window)
+
+    def set_state(self, state):
+        super(Percentile1D, self).set_state(state)
+        self.__setattr__('sample_', RollingWindow.from_array(
+            self.sample_, int(np.floor(self.window_size))
+        ))
+
+    def score_anomaly(self, x):
+        x = np.asarray(x, dtype=float)
+        return percentile_rank(self.sorted_sample_, x)
+
+    def flag_anomaly(self, x):
+        return decision_rule(self.score_anomaly(x), self.threshold)
+
+    def score_and_flag(self, x):
+        scores = self.score_anomaly(x)
+        return scores, decision_rule(scores, self.threshold)
+
+
+def _nearest_neighbours(sorted_sample, values, positions, offsets, k):
+    """ The k nearest neighbours in sorted_sample of each of values, among
+        the points at positions + offsets. In one dimension the window in
+        ascending order is its own neighbour index, so these candidates
+        always contain the k nearest neighbours.
+
+        Returns their positions and distances, shape (len(values), k).
+    """
+    candidates = positions[:, None] + offsets[None, :]
+    valid = (candidates >= 0) & (candidates < len(sorted_sample))
+    candidates = np.clip(candidates, 0, len(sorted_sample) - 1)
+    distances = np.where(
+        valid, np.abs(sorted_sample[candidates] - values[:, None]), np.inf
+    )
+    nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    return (np.take_along_axis(candidates, nearest, axis=1),
+            np.take_along_axis(distances, nearest, axis=1))
+
+
+def _dilate(mask, k):
+    """ Marks every position within k of a marked one """
+    positions = np.flatnonzero(mask)
+    starts = np.maximum(positions - k, 0)
+    ends = np.minimum(positions + k + 1, len(mask))
+    overlaps = (np.bincount(starts, minlength=len(mask) + 1) -
+                np.bincount(ends, minlength=len(mask) + 1))
+    return np.cumsum(overlaps[:-1]) > 0
+
+
+class LOF1D(BaseEstimator, AnomalyMixin):
+    """
+    Local outlier factor over a sliding window of the latest window_size
+    datapoints.
+
+    The window is kept in ascending order along with the k-distance and
+    local reachability density (LRD) of every point in it. Updates only
+    recompute the k-distances of the points within n_neighbors positions of
+    an insertion or eviction, whose neighbourhoods are the only ones that
+    can change, and the LRDs within n_neighbors positions of those, instead
+    of refitting on the whole window.
+
+    The score of a datapoint is 1 - 1/LOF, i.e. 0 for points that are as
+    dense as their neighbours and tending to 1 for isolated ones.
+
+    Missing and infinite values are left out of the window, since they have
+    no distance to the other points, and they are scored NaN.
+    """
+
+    def __init__(
+        self,
+        n_neighbors=20,
+        window_size=1000,
+        threshold=LOF_THRESHOLD
+    ):
+        self.n_neighbors = n_neighbors
+        self.window_size = window_size
+        self.threshold = threshold
+        self.sample_ = []
+
+    def _k(self, n_points):
+        return max(min(int(self.n_neighbors), n_points - 1), 1)
+
+    def _member_offsets(self, k):
+        return np.concatenate((np.arange(-k, 0), np.arange(1, k + 1)))
+
+    def _kdist(self, positions, k):
+        positions = np.flatnonzero(positions)
+        _, distances = _nearest_neighbours(
+            self.sorted_sample_, self.sorted_sample_[positions], positions,
+            self._member_offsets(k), k
+        )
+        self.kdist_[positions] = distances.max(axis=1)
+
+    def _lrd(self, positions, k):
+        positions = np.flatnonzero(positions)
+        neighbours, distances = _nearest_neighbours(
+            self.sorted_sample_, self.sorted_sample_[positions], positions,
+            self._member_offsets(k), k
         )
-        self.__setattr__('sample_', window)
+        reach = np.maximum(distances, self.kdist_[neighbours])
+        self.lrd_[positions] = 1. / (reach.mean(axis=1) + 1e-10)
+
+    def _refit(self):
+        n_points = len(self.sorted_sample_)
+        everything = np.ones(n_points, dtype=bool)
+        self.__setattr__('kdist_', np.empty(n_points))
+        self.__setattr__('lrd_', np.empty(n_points))
+        self._kdist(everything, self._k(n_points))
+        self._lrd(everything, self._k(n_points))
+
+    def fit(self, x):
+        x = np.asarray(x, dtype=float)
+        x = x[np.isfinite(x)]
+        if not len(x):
+            raise ValueError("Cannot fit without a finite datapoint")
+        w = int(np.floor(self.window_size))
+        self.__setattr__('sample_', RollingWindow.from_array(x[:w], w))
+        self.__setattr__('sorted_sample_', np.sort(x[:w]))
+        self._refit()
+
+    def update(self, x):  # allows mini-batch
+        x = np.asarray(x, dtype=float)
+        x = x[np.isfinite(x)]
+        if not len(x):
+            return
+        w = int(np.floor(self.window_size))
+        k_before = self._k(len(self.sample_))
+        # sample_ is in arrival order, so the oldest points are evicted
+        evicted = self.sample_.append(x)
+        k = self._k(len(self.sample_))
+        if len(x) >= w or k != k_before:
+            self.__setattr__('sorted_sample_', np.sort(np.asarray(self.sample_)))
+            self._refit()
+            return
+
+        delete_index, insert_index, new = sorted_window_edit(
+            self.sorted_sample_, evicted, x
+        )
+        # edit the arrays aligned with the window in the same way
+        sorted_window = np.insert(
+            np.delete(self.sorted_sample_, delete_index), insert_index, new
+        )
+        kdist = np.insert(np.delete(self.kdist_, delete_index),
+                          insert_index, np.nan)
+        lrd = np.insert(np.delete(self.lrd_, delete_index),
+                        insert_index, np.nan)
+
+        # where the window changed, in the positions of the updated window
+        changed = np.zeros(len(sorted_window), dtype=bool)
+        changed[insert_index + np.arange(len(new))] = True
+        gaps = delete_index - np.arange(len(delete_index))
+        gaps += np.searchsorted(insert_index, gaps, side='right')
+        changed[np.minimum(gaps, len(sorted_window) - 1)] = True
+
+        self.__setattr__('sorted_sample_', sorted_window)
+        self.__setattr__('kdist_', kdist)
+        self.__setattr__('lrd_', lrd)
+        # only the neighbourhoods within k of a change are different, and
+        # only the densities within k of those depend on them
+        neighbourhoods = _dilate(changed, k)
+        self._kdist(neighbourhoods, k)
+        self._lrd(_dilate(neighbourhoods, k), k)
+
+    def set_state(self, state):
+        super(LOF1D, self).set_state(state)
+        self.__setattr__('sample_', RollingWindow.from_array(
+            self.sample_, int(np.floor(self.window_size))
+        ))
 
     def score_anomaly(self, x):
-        x = pd.Series(x)
-        scores = pd.Series([0.01*percentileofscore(self.sample_, z) for z in x])
+        x = np.asarray(x, dtype=float)
+        k = self._k(len(self.sorted_sample_))
+        neighbours, distances = _nearest_neighbours(
+            self.sorted_sample_, x, np.searchsorted(self.sorted_sample_, x),
+            np.arange(-k, k), k
+        )
+        reach = np.maximum(distances, self.kdist_[neighbours])
+        # datapoints that aren't finite have no neighbours, hence no density
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lrd = 1. / (reach.mean(axis=1) + 1e-10)
+            lof = self.lrd_[neighbours].mean(axis=1) / lrd
+        scores = np.clip(1. - 1. / lof, 0., 1.)
+        scores[~np.isfinite(x)] = np.nan
         return scores
 
+    def flag_anomaly(self, x):
+        return decision_rule(self.score_anomaly(x), self.threshold,
+                             two_sided=False)
+
+    def score_and_flag(self, x):
+        scores = self.score_anomaly(x)
+        return scores, decision_rule(scores, self.threshold, two_sided=False)
+
+
+class Mahalanobis(BaseEstimator, AnomalyMixin):
+    """
+    Scores every row of a batch by its squared Mahalanobis distance from the
+    running mean of all the sensors, under their running covariance, so
+    that a combination of readings that is unusual for correlated sensors
+    stands out even if each reading is normal on its own.
+
+    The mean and covariance are updated with every batch, discounting the
+    past by the forgetting factor ff. The score is the chi-squared CDF of
+    the distance, which is uniform for Gaussian data, and every sensor of
+    a row gets the score and flag of the whole row.
+
+    Rows with a missing value (NaN) are left out of fit and update, since
+    the covariance only holds for readings of all the sensors at once, and
+    they are scored NaN and not flagged.
+    """
+    _columnwise = True
+    _multivariate = True
+
+    def __init__(
+        self,
+        ff=1.0,
+        threshold=THRESHOLD,
+        reg_covar=1e-6
+    ):
+        self.ff = ff
+        self.threshold = threshold
+        self.reg_covar = reg_covar
+
+    def _set_precision(self):
+        # the ridge keeps constant sensors from making the covariance singular
+        covariance = self.covariance_ + self.reg_covar * np.eye(len(self.mean_))
+        self.__setattr__('precision_', np.linalg.inv(covariance))
+
+    @staticmethod
+    def _complete_rows(x):
+        x = np.asarray(x, dtype=float)
+        x = x.reshape(len(x), -1)
+        return x[~np.isnan(x).any(axis=1)]
+
+    def fit(self, x):
+        x = self._complete_rows(x)
+        if not len(x):
+            raise ValueError("Cannot fit without a row of all the sensors")
+        centred = x - np.mean(x, axis=0)
+        self.__setattr__('mean_', np.mean(x, axis=0))
+        self.__setattr__('covariance_', centred.T @ centred / len(x))
+        self.__setattr__('ess_', len(x))
+        self._set_precision()
+
+    def update(self, x):  # allows mini-batch
+        try:
+            getattr(self, "mean_")
+        except AttributeError:
+            raise RuntimeError("You must fit the detector before updating it")
+        x = self._complete_rows(x)
+        if not len(x):
+            return
+        mean, covariance, ess = update_mean_covariance(
+            mean=self.mean_,
+            covariance=self.covariance_,
+            effective_sample_size=self.ess_,
+            x=x,
+            forgetting_factor=self.ff
+        )
+        self.__setattr__('ess_', ess)
+        self.__setattr__('mean_', mean)
+        self.__setattr__('covariance_', covariance)
+        self._set_precision()
+
+    def score_anomaly(self, x):
+        x = np.asarray(x, dtype=float)
+        centred = x.reshape(len(x), -1) - self.mean_
+        # a single matrix product for the whole batch
+        distances = np.einsum('ij,ij->i', centred @ self.precision_, centred)
+        scores = chdtr(len(self.mean_), distances)
+        if x.ndim == 1:
+            return scores
+        return np.repeat(scores[:, None], x.shape[1], axis=1)
+
+    def flag_anomaly(self, x):
+        return decision_rule(self.score_anomaly(x), self.threshold,
+                             two_sided=False)
+
+    def score_and_flag(self, x):
+        scores = self.score_anomaly(x)
+        return scores, decision_rule(scores, self.threshold, two_sided=False)
+
+
+class PercentileSketch1D(BaseEstimator, AnomalyMixin):
+    """
+    Percentile rank detector like Percentile1D, over a DDSketch-style
+    histogram of the data instead of a window of raw values, so its memory
+    doesn't grow with the amount of history it summarises.
+
+    Values are counted in logarithmically spaced buckets, separately for
+    positive and negative values, each bucket spanning a relative error of
+    relative_accuracy. Magnitudes below min_value share a zero bucket and
+    those above max_value share the outermost ones, so the state is a fixed
+    array of about log(max_value / min_value) / (2 * relative_accuracy)
+    counts per sign and sensor.
+
+    Updates add the counts of the batch to the existing ones, after
+    discounting them by the forgetting factor ff, so ff < 1 stands in for a
+    window of roughly batch_size / (1 - ff) datapoints. Sketches with the
+    same parameters can be merged by adding their counts.
+    """
+    _columnwise = True
+
+    def __init__(
+        self,
+        ff=1.0,
+        relative_accuracy=0.01,
+        min_value=1e-9,
+        max_value=1e9,
+        threshold=THRESHOLD
+    ):
+        self.ff = ff
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+        self.threshold = threshold
+
+    def _log_gamma(self):
+        return np.log((1 + self.relative_accuracy) /
+                      (1 - self.relative_accuracy))
+
+    def _n_buckets(self):
+        """ Buckets per sign """
+        return int(np.ceil(
+            np.log(self.max_value / self.min_value) / self._log_gamma()
+        ))
+
+    def _bucket(self, x):
+        """ The bucket of each value, in ascending order of the values they
+            hold: negative buckets, the zero bucket, then positive ones """
+        n_buckets = self._n_buckets()
+        magnitude = np.abs(x)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            key = np.ceil(np.log(magnitude / self.min_value) / self._log_gamma())
+        key = np.clip(np.nan_to_num(key, nan=0.), 1, n_buckets)
+        key = key.astype(np.int64)
+        sign = np.sign(np.nan_to_num(x)).astype(np.int64)
+        bucket = n_buckets + sign * key
+        bucket[~(magnitude > self.min_value)] = n_buckets
+        return bucket
+
+    def _count(self, x):
+        x = np.asarray(x, dtype=float)
+        columns = x.reshape(len(x), -1)
+        n_bins = 2 * self._n_buckets() + 1
+        bucket = self._bucket(columns) + n_bins * np.arange(columns.shape[1])
+        counts = np.bincount(
+            bucket[~np.isnan(columns)], minlength=n_bins * columns.shape[1]
+        ).reshape(columns.shape[1], n_bins).T
+        return counts[:, 0] if x.ndim == 1 else counts
+
+    def _set_counts(self, counts):
+        self.__setattr__('counts_', counts)
+        self.__setattr__('_ranks', None)
+
+    def _bucket_ranks(self):
+        """ The percentile rank of every bucket, computed once per update so
+            that scoring is a lookup. Values are assumed to sit in the
+            middle of their bucket """
+        if self._ranks is None:
+            ranks = np.cumsum(self.counts_, axis=0)
+            ranks -= 0.5 * self.counts_
+            ranks /= self.counts_.sum(axis=0)
+            self.__setattr__('_ranks', ranks)
+        return self._ranks
+
+    def fit(self, x):
+        self._set_counts(self._count(x).astype(float))
+
+    def update(self, x):  # allows mini-batch
+        self._set_counts(self.ff * self.counts_ + self._count(x))
+
+    def set_state(self, state):
+        super(PercentileSketch1D, self).set_state(state)
+        self._set_counts(self.counts_)
+
+    def merge(self, other):
+        """ Adds the counts of another sketch with the same parameters """
+        if other.get_params() != self.get_params():
+            raise ValueError('Cannot merge sketches with different parameters')
+        self._set_counts(self.counts_ + other.counts_)
+        return self
+
+    def score_anomaly(self, x):
+        x = np.asarray(x, dtype=float)
+        bucket = self._bucket(x)
+        if x.ndim == 1:
+            rank = self._bucket_ranks()[bucket]
+        else:
+            rank = np.take_along_axis(self._bucket_ranks(), bucket, axis=0)
+        rank[np.isnan(x)] = np.nan
+        return rank
+
     def flag_anomaly(self, x):
         return decision_rule(self.score_anomaly(x), self.threshold)
+
+    def score_and_flag(self, x):
+        scores = self.score_anomaly(x)
+        return scores, decision_rule(scores, self.threshold)
@@ -0,0 +1,133 @@
+"""
+Publish/subscribe ring buffer of scored rows
+
+The restreamer publishes every window of scored rows to a Broadcast, which
+keeps the latest capacity rows in one preallocated array per column. Any
+number of subscribers (Bokeh sessions, notebook views or other consumers)
+read the rows published since their own cursor, as views of those arrays,
+so a batch is stored once however many subscribers read it.
+
+A subscriber that falls more than capacity rows behind skips to the oldest
+row still in the buffer and counts the rows it missed in dropped.
+"""
+
+import threading
+
+import numpy as np
+import pandas as pd
+
+CAPACITY = 2**16
+
+
+class Broadcast(object):
+    """ Columnar ring buffer that one writer publishes rows to """
+
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self.columns = None
+        self.buffers = {}
+        self.head = 0 # number of rows published so far
+        self.condition = threading.Condition()
+
+    def publish(self, columns):
+        """ Append rows, overwriting the oldest ones. The rows are given as
+            a dataframe or a dict of column arrays, such as Batch.columns """
+        names = list(columns)
+        n_rows = len(columns[names[0]]) if names else 0
+        if not n_rows:
+            return
+        # rows that would be overwritten within this batch are skipped
+        skipped = max(n_rows - self.capacity, 0)
+        n_rows -= skipped
+
+        with self.condition:
+            if self.columns is None: # the first batch fixes the schema
+                self.columns = names
+                self.buffers = {
+                    name: np.empty(self.capacity,
+                                   dtype=np.asarray(columns[name]).dtype)
+                    for name in self.columns
+                }
+            self.head += skipped
+            start = self.head % self.capacity
+            first = min(n_rows, self.capacity - start)
+            for name in self.columns:
+                values = np.asarray(columns[name])[skipped:]
+                buffer = self.buffers[name]
+                buffer[start:start + first] = values[:first]
+                buffer[:n_rows - first] = values[first:]
+            self.head += n_rows
+            self.condition.notify_all()
+
+    def subscribe(self, from_start=False):
+        """ A new subscriber, reading either every row still in the buffer
+            or only rows published from now on """
+        with self.condition:
+            cursor = max(self.head - self.capacity, 0) if from_start \
+                else self.head
+        return Subscriber(self, cursor)
+
+    def _read(self, cursor, max_rows=None):
+        """ The columns of the rows from cursor onwards, the new cursor and
+            the number of rows that were overwritten before being read """
+        with self.condition:
+            head = self.head
+            start = max(cursor, head - self.capacity)
+            dropped = start - cursor
+            if max_rows is not None:
+                start = max(start, head - max_rows)
+            if start == head:
+                return {}, head, dropped
+
+            begin, end = start % self.capacity, head % self.capacity
+            if begin < end:
+                columns = {column: buffer[begin:end]
+                           for column, buffer in self.buffers.items()}
+            else: # the rows wrap around the end of the buffer
+                columns = {
+                    column: np.concatenate((buffer[begin:], buffer[:end]))
+                    for column, buffer in self.buffers.items()
+                }
+        return columns, head, dropped
+
+    def wait(self, cursor, timeout=None):
+        """ Block until rows after cursor are published or timeout seconds
+            pass, returning whether there are any """
+        with self.condition:
+            return self.condition.wait_for(lambda: self.head > cursor,
+                                           timeout)
+
+
+class Subscriber(object):
+    """ Reads the rows of a Broadcast at its own pace """
+
+    def __init__(self, broadcast, cursor):
+        self.broadcast = broadcast
+        self.cursor = cursor
+        self.dropped = 0
+
+    def pending(self):
+        """ Number of published rows this subscriber hasn't read yet """
+        return self.broadcast.head - self.cursor
+
+    def read(self, max_rows=None):
+        """ The rows published since the last read as a dict of column
+            arrays, in the order they were published. With max_rows only
+            the latest max_rows of them are returned.
+
+            The arrays are views of the broadcast buffer, valid until the
+            writer wraps around to them, so copy them to keep them.
+        """
+        columns, self.cursor, dropped = self.broadcast._read(self.cursor,
+                                                             max_rows)
+        self.dropped += dropped
+        return columns
+
+    def read_dataframe(self, max_rows=None):
+        """ Like read, but copied into a dataframe """
+        columns = self.read(max_rows)
+        return pd.DataFrame(columns, columns=self.broadcast.columns)
+
+    def wait(self, timeout=None):
+        """ Block until there are rows to read or timeout seconds pass """
+        return self.broadcast.wait(self.cursor, timeout)
@@ -0,0 +1,137 @@
+"""
+Detector state checkpoints
+
+A checkpoint holds the learned state of the models of every sensor in a
+single uncompressed .npz file, together with the detector name and the
+sensor order it was saved with, so that scoring can resume from it without
+refitting. Checkpoints are written to a temporary file next to the target
+and renamed over it, so a crash mid-write never leaves a truncated one.
+"""
+
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from .exceptions import CheckpointError
+
+CHECKPOINT_VERSION = 1
+METADATA_KEY = '__dsio__'
+
+
+def save_checkpoint(path, model, detector, sensors, n_rows=0):
+    """ Atomically write the state of model to path """
+    try:
+        state = model.get_state()
+    except ValueError as exc: # ragged per-sensor state can't be stacked
+        raise CheckpointError('Cannot checkpoint %s' % detector.__name__, exc)
+
+    metadata = {
+        'version': CHECKPOINT_VERSION,
+        'detector': detector.__name__,
+        'sensors': list(sensors),
+        'rows': int(n_rows),
+        'saved': time.time(),
+    }
+    arrays = {METADATA_KEY: np.array(json.dumps(metadata))}
+    for name, value in state.items():
+        if value.dtype == object:
+            raise CheckpointError('Cannot checkpoint %s, its state %s is not '
+                                  'numeric' % (detector.__name__, name))
+        arrays[name] = value
+
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as checkpoint_file:
+            np.savez(checkpoint_file, **arrays)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def checkpoint_metadata(path):
+    """ The metadata of a checkpoint, without reading the model state """
+    try:
+        with np.load(path, allow_pickle=False) as checkpoint:
+            return json.loads(str(checkpoint[METADATA_KEY]))
+    except (OSError, ValueError, KeyError) as exc:
+        raise CheckpointError('Cannot read %s' % path, exc)
+
+
+def load_checkpoint(path, detector, sensors):
+    """ Read a checkpoint, checking that it was saved for the same detector
+        and sensors. Returns the model state and the checkpoint metadata. """
+    try:
+        with np.load(path, allow_pickle=False) as checkpoint:
+            metadata = json.loads(str(checkpoint[METADATA_KEY]))
+            state = {name: checkpoint[name] for name in checkpoint.files
+                     if name != METADATA_KEY}
+    except (OSError, ValueError, KeyError) as exc:
+        raise CheckpointError('Cannot read %s' % path, exc)
+
+    if metadata['version'] != CHECKPOINT_VERSION:
+        raise CheckpointError('%s has unsupported version %s'
+                              % (path, metadata['version']))
+    if metadata['detector'].lower() != detector.__name__.lower():
+        raise CheckpointError('%s was saved by %s, not %s' % (
+            path, metadata['detector'], detector.__name__))
+    if sorted(metadata['sensors']) != sorted(sensors):
+        raise CheckpointError('%s was saved for sensors %s' % (
+            path, ', '.join(metadata['sensors'])))
+
+    return reorder_state(state, detector, metadata['sensors'], sensors), \
+        metadata
+
+
+def reorder_state(state, detector, saved_sensors, sensors):
+    """ State saved for saved_sensors, rearranged for the same sensors in
+        the order of sensors
+
+        The sensors are on the last axis of the state of every detector
+        but multivariate ones, which keep them on every axis that has one
+        entry per sensor, like the rows and columns of a covariance matrix.
+    """
+    sensors = list(sensors)
+    if list(saved_sensors) == sensors:
+        return state
+    order = np.array([list(saved_sensors).index(sensor)
+                      for sensor in sensors])
+    reordered = {}
+    for name, value in state.items():
+        for axis in range(value.ndim):
+            if axis == value.ndim - 1 or (
+                    detector._multivariate and
+                    value.shape[axis] == len(sensors)):
+                value = np.take(value, order, axis=axis)
+        reordered[name] = value
+    return reordered
+
+
+class Checkpointer(object):
+    """ Saves the state of a model to path at most every interval seconds,
+        counting the rows it has been updated with """
+
+    def __init__(self, path, detector, sensors, interval=60.0, n_rows=0):
+        self.path = path
+        self.detector = detector
+        self.sensors = list(sensors)
+        self.interval = interval
+        self.n_rows = n_rows
+        self.last_saved = time.time()
+
+    def update(self, model, n_rows):
+        """ Count n_rows more rows and save if a checkpoint is due """
+        self.n_rows += n_rows
+        if time.time() - self.last_saved >= self.interval:
+            self.save(model)
+
+    def save(self, model):
+        save_checkpoint(self.path, model, self.detector, self.sensors,
+                        self.n_rows)
+        self.last_saved = time.time()
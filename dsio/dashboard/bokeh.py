@@ -1,8 +1,7 @@
 """ bokeh dashboard integration """
-import threading
 import webbrowser
 
-import tornado.ioloop
+import numpy as np
 
 from bokeh.server.server import Server
 from bokeh.application import Application
@@ -12,9 +11,57 @@ from bokeh.layouts import gridplot
 from bokeh.models import HoverTool
 from bokeh.io import output_notebook, show
 
+from .. import metrics
 
-def generate_dashboard(sensors, title, cols=3, port=5001, update_queue=None):
-    """ Returns a bokeh server configured with the dsio dashboard app"""
+PLOT_WIDTH = 600
+ROLLOVER = 20 * PLOT_WIDTH
+
+
+def downsample(columns, sensors, buckets=PLOT_WIDTH, timefield='time'):
+    """ Reduce time-sorted columns (a dict of arrays, as read from a
+        Broadcast) to two rows per bucket of consecutive rows: one with the
+        minimum and one with the maximum of every sensor, so that spikes
+        survive. Both rows carry the highest score and any flag raised
+        within their bucket.
+    """
+    n_rows = len(columns[timefield])
+    if n_rows <= 2 * buckets:
+        return columns
+
+    starts = np.linspace(0, n_rows, buckets, endpoint=False).astype(np.int64)
+    ends = np.append(starts[1:], n_rows) - 1
+
+    # interleave the low and high rows of each bucket
+    reduced = {
+        timefield: np.column_stack((columns[timefield][starts],
+                                    columns[timefield][ends])).ravel()
+    }
+    for sensor in sensors:
+        values = columns[sensor]
+        reduced[sensor] = np.column_stack((
+            np.minimum.reduceat(values, starts),
+            np.maximum.reduceat(values, starts)
+        )).ravel()
+        reduced['SCORE_%s' % sensor] = np.repeat(
+            np.maximum.reduceat(columns['SCORE_%s' % sensor], starts), 2)
+        reduced['FLAG_%s' % sensor] = np.repeat(
+            np.logical_or.reduceat(columns['FLAG_%s' % sensor], starts), 2)
+    return reduced
+
+
+def generate_dashboard(sensors, title, cols=3, port=5001, broadcast=None,
+                       rollover=ROLLOVER, buckets=PLOT_WIDTH, notebook=False):
+    """ Returns a bokeh server configured with the dsio dashboard app, or
+        shows the app inline if notebook is set
+
+        The server is started on the current event loop, so it should be
+        called from a coroutine (or a loop that's going to be run).
+
+        Every session subscribes to the broadcast of scored rows on its own,
+        so each open dashboard shows all of them. Every update keeps at most
+        2 * buckets points per sensor (see downsample) and the browser keeps
+        the latest rollover points.
+    """
 
     def make_document(doc):
         """ Generates the dashboard document """
@@ -33,7 +80,7 @@ def generate_dashboard(sensors, title, cols=3, port=5001, update_queue=None):
         figures = []
         for sensor in sensors:
             fig = figure(title=sensor, tools=tools, x_axis_type='datetime',
-                         plot_width=600, plot_height=300)
+                         plot_width=PLOT_WIDTH, plot_height=300)
             fig.line('time', sensor, source=source)
             sensor_score = 'SCORE_%s' % sensor
             sensor_flag = 'FLAG_%s' % sensor
@@ -59,23 +106,36 @@ def generate_dashboard(sensors, title, cols=3, port=5001, update_queue=None):
         doc.add_root(grid)
 
         def update():
-            """ Check the queue for updates sent by the restreamer thread
-                and pass them over to the bokeh data soure """
-            data = update_queue.get().to_dict('list')
-            source.stream(data)
+            """ Read the rows published since the last update without
+                blocking, and pass them over to the bokeh data source in a
+                single downsampled stream call """
+            metrics.gauge('queue_depth', subscriber.pending(),
+                          queue='dashboard')
+            # older rows would be rolled over straight away
+            columns = subscriber.read(max_rows=rollover)
+            if not columns:
+                return
+            with metrics.timed('dashboard_update') as timer:
+                timer.rows = len(columns['time'])
+                latest = columns['time'][-1]
+                columns = downsample(columns, sensors, buckets)
+                source.stream({name: columns[name] for name in data},
+                              rollover=rollover)
+            metrics.event_lag('dashboard', latest)
 
-        if update_queue: # Update every second
+        if broadcast: # Update every second
+            subscriber = broadcast.subscribe(from_start=True)
             doc.add_periodic_callback(update, 1000)
 
     app = Application(FunctionHandler(make_document))
 
-    io_loop = tornado.ioloop.IOLoop.current()
-
-    if io_loop._running: # Assume we're in a Jupyter notebook
+    if notebook: # show it inline, on the notebook's own event loop
         output_notebook()
         show(app)
-    else: # Otherwise start the bokeh server in a thread and open browser
-        server = Server({'/': app}, port=port)
-        dashboard_thread = threading.Thread(target=server.io_loop.start, daemon=True)
-        dashboard_thread.start()
-        webbrowser.open('http://localhost:%s' % port)
+        return None
+
+    # Serve it on the event loop of the caller, which has to run it
+    server = Server({'/': app}, port=port)
+    server.start()
+    webbrowser.open('http://localhost:%s' % port)
+    return server
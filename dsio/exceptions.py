@@ -63,3 +63,23 @@ class ElasticsearchConnectionError(DsioError):
 class KibanaConfigNotFoundError(DsioError):
     msg = "Kibana config index not found in Elasticsearch"
     code = 6
+
+
+class InputSourceError(DsioError):
+    msg = "Cannot read from input source"
+    code = 7
+
+
+class CheckpointError(DsioError):
+    msg = "Cannot save or restore detector checkpoint"
+    code = 8
+
+
+class InvalidBatchError(DsioError):
+    msg = "Input batch cannot be scored"
+    code = 9
+
+
+class ScoringWorkerError(DsioError):
+    msg = "Scoring worker failed"
+    code = 10
@@ -1,16 +1,36 @@
 """ Helper functions """
 
 import argparse
+import datetime
+import json
+import os
+import sys
 import time
-
-import dateparser
+import types
 
 import numpy as np
 import pandas as pd
 
+from pandas.api.types import is_numeric_dtype
+
+try:
+    from pandas.tseries.api import guess_datetime_format
+except ImportError: # pandas < 2.2
+    try:
+        from pandas._libs.tslibs.parsing import guess_datetime_format
+    except ImportError:
+        guess_datetime_format = None
+
 from .exceptions import SensorsNotFoundError, TimefieldNotFoundError
 from .exceptions import ModuleLoadError, DetectorNotFoundError
-from .anomaly_detectors import AnomalyMixin
+from .exceptions import InvalidBatchError
+from . import metrics
+
+TIME_FORMAT_CACHE = os.path.join(
+    os.environ.get('DSIO_CACHE_DIR',
+                   os.path.join(os.path.expanduser('~'), '.cache', 'dsio')),
+    'time_formats.json'
+)
 
 
 def parse_arguments():
@@ -31,6 +51,9 @@ def parse_arguments():
                         default="http://localhost:5601/app/kibana")
     parser.add_argument("--bokeh-port", help="Bokeh server port", default="5001")
     parser.add_argument("--es-index", help="Elasticsearch index name")
+    parser.add_argument("--es-workers",
+                        help="Number of parallel Elasticsearch bulk writers",
+                        default="4")
     parser.add_argument("--entry-type", help="Entry type name",
                         default="measurement")
     parser.add_argument("-v", "--verbose", help="Increase output verbosity",
@@ -42,94 +65,302 @@ def parse_arguments():
                         default="")
     parser.add_argument("--speed", help="Restreamer speed",
                         default="1.0")
+    parser.add_argument("--fast",
+                        help="Replay as fast as possible instead of in real "
+                             "time, e.g. to backfill Elasticsearch",
+                        action="store_true")
     parser.add_argument("--cols", help="Dashboard columns",
                         default="3")
-    parser.add_argument('input', help='input file or stream')
+    parser.add_argument("-j", "--jobs",
+                        help="Number of processes to shard the sensors across",
+                        default="1")
+    parser.add_argument("--batch-size", help="Number of rows scored at once",
+                        default="1000")
+    parser.add_argument("--chunked",
+                        help="Read the input in batch-size chunks instead of "
+                             "loading it all in memory",
+                        action="store_true")
+    parser.add_argument("--max-batches",
+                        help="Maximum number of batches waiting between "
+                             "any two stages of the restream pipeline",
+                        default="4")
+    parser.add_argument("--float32",
+                        help="Keep sensor values and scores as float32 "
+                             "rather than float64, halving their memory",
+                        action="store_true")
+    parser.add_argument("--follow",
+                        help="Keep reading the input file as it grows",
+                        action="store_true")
+    parser.add_argument("--format", help="Format of live input streams",
+                        choices=["csv", "json"])
+    parser.add_argument("--max-wait",
+                        help="Maximum seconds to wait for a live input batch "
+                             "to fill up before scoring it",
+                        default="1.0")
+    parser.add_argument("--checkpoint",
+                        help="File to periodically save the detector state to")
+    parser.add_argument("--checkpoint-interval",
+                        help="Seconds between detector checkpoints",
+                        default="60")
+    parser.add_argument("--resume",
+                        help="Start from the detector state saved in "
+                             "--checkpoint instead of refitting, skipping "
+                             "the input rows seen before it (unless the "
+                             "input is a live source)",
+                        action="store_true")
+    parser.add_argument("--metrics-port",
+                        help="Serve pipeline metrics in the Prometheus text "
+                             "format on this port")
+    parser.add_argument("--metrics-interval",
+                        help="Log pipeline metrics as JSON to stderr every "
+                             "this many seconds")
+    parser.add_argument('input',
+                        help="input file or stream: '-' for stdin, "
+                             "tcp://host:port or unix:///path/to/socket")
     return parser.parse_args()
 
 
+def infer_time_format(values):
+    """ Guess the datetime format of a sample of strings, returning None if
+        pandas can't infer one that parses all of them """
+    if guess_datetime_format is None:
+        return None
+    values = pd.Series(values).dropna().astype(str)
+    if values.empty:
+        return None
+    time_format = guess_datetime_format(values.iloc[0])
+    if time_format is None:
+        return None
+    parsed = pd.to_datetime(values, format=time_format, errors='coerce',
+                            utc=True)
+    return time_format if parsed.notnull().all() else None
+
+
+def parse_times(values, time_format=None):
+    """ Parse date strings to UTC datetimes in one vectorized pass, falling
+        back to dateparser for formats that pandas doesn't understand """
+    try:
+        return pd.to_datetime(pd.Series(values), format=time_format,
+                              utc=True)
+    except (ValueError, TypeError):
+        import dateparser # slow to import, so only load it when needed
+        return pd.to_datetime(
+            pd.Series([dateparser.parse(str(value)) for value in values]),
+            utc=True
+        )
+
+
+def parse_score_arguments(argv=None):
+    """ Parse command line arguments of `dsio score` """
+    parser = argparse.ArgumentParser(
+        prog='dsio score',
+        description="Score a whole input file offline, as fast as possible"
+    )
+    parser.add_argument("--detector", help="Anomaly detector",
+                        default="Gaussian1D")
+    parser.add_argument("--modules",
+                        help="Python modules that define additional anomaly "
+                             "detectors",
+                        nargs='+', default=[])
+    parser.add_argument("-s", '--sensors', help="Select specific sensor names",
+                        nargs='+')
+    parser.add_argument("-t", "--timefield",
+                        help="name of the column in the data that defines the time",
+                        default="")
+    parser.add_argument("-j", "--jobs",
+                        help="Number of processes to shard the sensors across",
+                        default="1")
+    parser.add_argument("--batch-size", help="Number of rows scored at once",
+                        default="10000")
+    parser.add_argument("--checkpoint",
+                        help="File to periodically save the detector state to")
+    parser.add_argument("--checkpoint-interval",
+                        help="Seconds between detector checkpoints",
+                        default="60")
+    parser.add_argument("--resume",
+                        help="Start from the detector state saved in "
+                             "--checkpoint instead of refitting, skipping "
+                             "the input rows seen before it",
+                        action="store_true")
+    parser.add_argument('input', help='input csv file')
+    parser.add_argument('output',
+                        help="output .parquet or .arrow file, or a directory "
+                             "for .npy files")
+    return parser.parse_args(argv)
+
+
 def detect_time(dataframe):
-    """ Attempt to detect the time dimension in a dataframe"""
+    """ Attempt to detect the time dimension in a dataframe
+
+    Returns the name of the time column (None if there isn't one), whether
+    it holds unix timestamps and, for date strings, their format (None if
+    it can't be inferred).
+    """
     columns = set(dataframe.columns)
-    timefield = unix = None
     for tfname in ['time', 'datetime', 'date', 'timestamp']:
-        if tfname in columns:
-            prev = current = None
-            unix = True # Assume unix timestamp format unless proven otherwise
-            for i in dataframe[tfname][:10]: # FIXME this seems arbitrary
-                try:
-                    current = dateparser.parse(str(i))
-                    # timefield needs to be parsable and always increasing
-                    if not current or (prev and prev > current):
-                        tfname = ''
-                        break
-                    if unix and not (isinstance(i, float) or
-                                     isinstance(i, int)):
-                        unix = False
-                except TypeError:
-                    tfname = ''
-                    break
-            prev = current
-            if tfname:
-                timefield = tfname
-                if isinstance(i, float) or isinstance(i, int):
-                    unix = True
-                break
-
-    return timefield, unix
-
-
-def normalize_timefield(dataframe, timefield, speed=5):
+        if tfname not in columns:
+            continue
+        sample = dataframe[tfname].iloc[:10] # FIXME this seems arbitrary
+        # timefield needs to be parsable and always increasing
+        if is_numeric_dtype(sample):
+            if sample.notnull().all() and sample.is_monotonic_increasing:
+                return tfname, True, None
+            continue
+
+        time_format = infer_time_format(sample)
+        try:
+            parsed = parse_times(sample, time_format)
+        except (ValueError, TypeError):
+            continue
+        if parsed.notnull().all() and parsed.is_monotonic_increasing:
+            return tfname, False, time_format
+
+    return None, None, None
+
+
+def load_time_format(cache_key):
+    """ Look up the time dimension detected in a previous run """
+    try:
+        with open(TIME_FORMAT_CACHE) as cache_file:
+            return json.load(cache_file).get(cache_key)
+    except (OSError, ValueError):
+        return None
+
+
+def save_time_format(cache_key, entry):
+    """ Remember the time dimension detected for cache_key """
+    try:
+        with open(TIME_FORMAT_CACHE) as cache_file:
+            cache = json.load(cache_file)
+    except (OSError, ValueError):
+        cache = {}
+    cache[cache_key] = entry
+    try:
+        os.makedirs(os.path.dirname(TIME_FORMAT_CACHE), exist_ok=True)
+        tmp_path = '%s.%d' % (TIME_FORMAT_CACHE, os.getpid())
+        with open(tmp_path, 'w') as cache_file:
+            json.dump(cache, cache_file)
+        os.replace(tmp_path, TIME_FORMAT_CACHE)
+    except OSError:
+        pass
+
+
+def cached_time_format(dataframe, timefield, cache_key):
+    """ Return the cached (timefield, unix, time_format) for cache_key if
+        it still matches the dataframe, otherwise None """
+    cached = load_time_format(cache_key)
+    if not cached or cached['timefield'] not in dataframe.columns:
+        return None
+    if timefield and timefield != cached['timefield']:
+        return None
+    column = dataframe[cached['timefield']]
+    if cached['unix'] != is_numeric_dtype(column):
+        return None
+    if cached['time_format']:
+        parsed = pd.to_datetime(column.iloc[:10], format=cached['time_format'],
+                                errors='coerce', utc=True)
+        if parsed.isnull().any():
+            return None
+    return cached['timefield'], cached['unix'], cached['time_format']
+
+
+def detect_timefield(dataframe, timefield, cache_key=None):
+    """ Check the given timefield or try to detect one in the dataframe
+
+    If a cache_key (e.g. the input file path) is given, the detected time
+    dimension is remembered for the next run on the same input.
+    """
     available_sensor_names = set(dataframe.columns)
 
     # Get timefield from args
-    if timefield and timefield not in set(dataframe.columns):
+    if timefield and timefield not in available_sensor_names:
         raise TimefieldNotFoundError(timefield)
 
-    if not timefield: # Try to auto detect timefield
-        timefield, unix = detect_time(dataframe)
-
-    # If no timefield can be detected treat input as timeseries
-    if not timefield:
-        # Add time dimension with fixed intervals starting from now
-        timefield = 'time'
-        unix = True
-        start = int(time.time())
-        dataframe[timefield] = pd.Series(
-            range(start, start+dataframe.shape[0]),
-            index=dataframe.index
+    cached = cache_key and cached_time_format(dataframe, timefield, cache_key)
+    if cached:
+        timefield, unix, time_format = cached
+    elif timefield:
+        unix = is_numeric_dtype(dataframe[timefield])
+        time_format = None if unix else infer_time_format(
+            dataframe[timefield].iloc[:10]
         )
-    else:
+    else: # Try to auto detect timefield
+        timefield, unix, time_format = detect_time(dataframe)
+
+    if timefield:
         available_sensor_names.remove(timefield)
+        if cache_key and not cached:
+            save_time_format(cache_key, {
+                'timefield': timefield, 'unix': unix,
+                'time_format': time_format
+            })
+
+    return timefield, unix, time_format, available_sensor_names
+
+
+def timefield_normalizer(dataframe, timefield, unix, speed=5,
+                         time_format=None, replay=True):
+    """ Returns a function that rewrites the time dimension of a dataframe
+        (or of consecutive chunks of it) as replay timestamps in unix
+        milliseconds, starting from now and sped up by speed, along with
+        the name of the column that will hold them. If replay is False the
+        original timestamps are kept, only converted to milliseconds.
+
+        The dataframe is only used to find the first timestamp.
+    """
+    start = int(time.time())
+    rows_seen = 0
+
+    def to_milliseconds(chunk):
+        nonlocal rows_seen
+        # If no timefield can be detected treat input as timeseries
+        # with fixed intervals starting from now
+        if not timefield:
+            first_row = rows_seen
+            rows_seen += chunk.shape[0]
+            return 1000 * (start + np.arange(first_row, rows_seen))
+        if not unix:
+            return parse_times(
+                chunk[timefield].values, time_format
+            ).values.astype('datetime64[ms]').astype(np.int64)
+        return np.floor(chunk[timefield].values*1000).astype(np.int64)
+
+    if timefield:
+        first_timestamp = to_milliseconds(dataframe.iloc[:1])[0]
+    else:
+        first_timestamp = 1000 * start
+    replay_timefield = timefield if timefield and unix else 'time'
+
+    print('data found from {}'.format(
+        datetime.datetime.fromtimestamp(first_timestamp/1000.)
+    ))
+
+    if replay:
+        now = int(np.round(time.time()*1000))
+        time_offset = now - first_timestamp
+        print('Adding time offset of %.2f seconds' % float(time_offset/1000.0))
+        print('Setting speed to %sx' % ('%f' % speed).rstrip('0').rstrip('.'))
+    else:
+        now, speed = first_timestamp, 1
+
+    def normalize(chunk):
+        """ Writes the replay timestamps of the chunk to replay_timefield """
+        chunk[replay_timefield] = (
+            now + (to_milliseconds(chunk) - first_timestamp)/speed
+        ).astype(np.int64)
+        return chunk
+
+    return normalize, replay_timefield
+
 
-    if not unix:
-        dataframe['time'] = pd.to_datetime(
-            dataframe[timefield],
-            infer_datetime_format=True
-        ).values.astype(np.int64) // 10 ** 9
-        timefield = 'time'
-        unix = True
-
-    min_time = dataframe[timefield][0]
-    max_time = dataframe[timefield][dataframe[timefield].size-1]
-
-    print('data found from {} to {}'\
-            .format(dateparser.parse(str(min_time)),
-                    dateparser.parse(str(max_time))))
-
-    if unix:
-        print('Converting to milliseconds ...')
-        dataframe[timefield] = np.floor(dataframe[timefield]*1000).astype('int')
-        print('Done')
-
-    now = np.int(np.round(time.time()*1000))
-    first_timestamp = dataframe[timefield][0]
-    time_offset = now - first_timestamp
-    print('Adding time offset of %.2f seconds' % float(time_offset/1000.0))
-    print('Setting speed to %sx' % ('%f' % speed).rstrip('0').rstrip('.'))
-    dataframe[timefield] = (now + (dataframe[timefield] -
-                                   first_timestamp)/speed).astype(int)
-    print('Done')
+def normalize_timefield(dataframe, timefield, speed=5, cache_key=None):
+    timefield, unix, time_format, available_sensor_names = detect_timefield(
+        dataframe, timefield, cache_key
+    )
+    normalize, timefield = timefield_normalizer(
+        dataframe, timefield, unix, speed, time_format
+    )
+    dataframe = normalize(dataframe)
 
     return dataframe, timefield, available_sensor_names
 
@@ -146,29 +377,112 @@ def select_sensors(dataframe, sensors, available_sensor_names, timefield):
         raise SensorsNotFoundError(sensor_names)
 
     for sensor in sensor_names.copy():
-        if dataframe[sensor].dtype == np.dtype('O'):
+        if not is_numeric_dtype(dataframe[sensor]):
             sensor_names.remove(sensor)
+    # in the order of the columns, which unlike the order of a set is the
+    # same in every process (see load_checkpoint)
+    sensor_names = [column for column in dataframe.columns
+                    if column in sensor_names and column != timefield]
 
     ### Copy selected sensors to new dataframe
-    df_copy = dataframe[[timefield] + list(sensor_names)].copy()
+    df_copy = dataframe[[timefield] + sensor_names].copy()
 
     return df_copy, sensor_names
 
 
-def load_detector(name, modules):
-    """ Evaluate modules as Python code and load selecter anomaly detector """
-    # Try to load modules
+def normalize_chunks(chunks, timefield, sensors, speed=5, cache_key=None,
+                     replay=True):
+    """ Lazily normalize the time dimension and select the sensors of an
+        iterable of dataframe chunks, e.g. pd.read_csv(..., chunksize=n)
+
+        The timefield and the sensors are detected on the first chunk, and
+        every following chunk is replayed with the same time offset (see
+        timefield_normalizer for replay).
+        Returns a generator over the normalized chunks, the timefield and
+        the selected sensor names.
+    """
+    chunks = iter(chunks)
+    first = next(chunks)
+    timefield, unix, time_format, available_sensor_names = detect_timefield(
+        first, timefield, cache_key
+    )
+    normalize, timefield = timefield_normalizer(
+        first, timefield, unix, speed, time_format, replay
+    )
+
+    first, sensor_names = select_sensors(
+        normalize(first), sensors, available_sensor_names, timefield
+    )
+    columns = list(first.columns)
+
+    def generate():
+        yield first
+        for chunk in chunks:
+            yield normalize(chunk)[columns]
+
+    return generate(), timefield, sensor_names
+
+
+def iter_batches(dataframe, batch_size):
+    """ Split a dataframe into consecutive batches of up to batch_size rows """
+    for start in range(0, dataframe.shape[0], batch_size):
+        yield dataframe.iloc[start:start+batch_size]
+
+
+def skip_rows(batches, n_rows):
+    """ Drop the first n_rows rows of an iterable of dataframe batches """
+    for batch in batches:
+        if n_rows >= batch.shape[0]:
+            n_rows -= batch.shape[0]
+            continue
+        yield batch.iloc[n_rows:] if n_rows else batch
+        n_rows = 0
+
+
+def skip_seen_rows(batches, checkpoint):
+    """ Drop the rows the models saved in checkpoint were updated with, so
+        that resuming on the same input doesn't learn from them twice """
+    from .checkpoint import checkpoint_metadata
+
+    n_rows = checkpoint_metadata(checkpoint)['rows']
+    print('Skipping the {} rows seen before the checkpoint'.format(n_rows))
+    return skip_rows(batches, n_rows)
+
+
+# Modules loaded by load_detector, which the worker processes of a sharded
+# detector load again (see dsio.parallel)
+LOADED_MODULES = []
+# The namespace they're evaluated in, importable so that the detectors they
+# define can be pickled
+user_modules = types.ModuleType('dsio.user_modules')
+sys.modules[user_modules.__name__] = user_modules
+
+
+def load_modules(modules):
+    """ Evaluate modules, .py files or importable module names, as Python
+        code in the dsio.user_modules namespace """
     for module in modules:
         if module.endswith('.py'):
             code = open(module).read()
         else:
             code = 'import %s' % module
         try:
-            exec(code)
+            exec(code, user_modules.__dict__)
         except Exception as exc:
             raise ModuleLoadError('Failed to load module %s. Exception: %r', (module, exc))
+        if module not in LOADED_MODULES:
+            LOADED_MODULES.append(module)
+
+
+def load_detector(name, modules):
+    """ Evaluate modules as Python code and load selecter anomaly detector """
+    # Try to load modules
+    load_modules(modules)
+
+    # Load selected anomaly detector, the built-in ones import scikit-learn
+    # so they're only loaded here
+    from .anomaly_detectors import AnomalyMixin
 
-    # Load selected anomaly detector
     for detector in AnomalyMixin.__subclasses__():
         if detector.__name__.lower() == name.lower():
             return detector
@@ -176,10 +490,172 @@ def load_detector(name, modules):
     raise DetectorNotFoundError("Can't find detector: %s" % name)
 
 
-def init_detector_models(sensors, training_set, detector):
-    """ Initialize anomaly detector models """
-    models = {}
-    for sensor in sensors:
-        models[sensor] = detector()
-        models[sensor].fit(training_set[sensor])
-    return models
+def init_detector_models(sensors, training_set, detector, n_jobs=1,
+                         state=None):
+    """ Initialize anomaly detector models
+
+    Returns a single model that scores all the sensors of a batch at once.
+    Columnwise detectors hold the per-sensor state themselves, any other
+    detector gets one instance per sensor behind a PerSensorDetector.
+    With n_jobs > 1 the sensors are sharded across that many processes,
+    unless the detector is multivariate and needs to see them all at once.
+    If a checkpointed state is given it's restored instead of fitting the
+    models on training_set, a dataframe with a column per sensor or an
+    array of their values.
+    """
+    if n_jobs > 1 and not detector._multivariate:
+        from .parallel import ShardedDetector
+
+        model = ShardedDetector(detector, len(sensors), n_jobs)
+    elif detector._columnwise:
+        model = detector()
+    else:
+        from .anomaly_detectors import PerSensorDetector
+
+        model = PerSensorDetector(detector, len(sensors))
+    if isinstance(training_set, pd.DataFrame):
+        training_set = training_set[list(sensors)].values
+    if state is None:
+        model.fit(training_set)
+    else:
+        model.set_state(state)
+    return model
+
+
+def check_batch(values, n_sensors):
+    """ The values of a batch as the float64 array of shape
+        (n_rows, n_sensors) that detectors take, or InvalidBatchError
+
+        Detectors trust their input to have this shape and dtype rather than
+        checking it on every call, so a stream only needs to check its first
+        batch: the rows of the later ones have the same columns.
+    """
+    values = np.asarray(values)
+    if values.ndim != 2 or values.shape[1] != n_sensors:
+        raise InvalidBatchError(
+            'expected an array of shape (n_rows, {}), got {}'.format(
+                n_sensors, values.shape))
+    if values.dtype.kind not in 'biuf':
+        raise InvalidBatchError(
+            'sensor values must be numeric, got {}'.format(values.dtype))
+    return np.asarray(values, dtype=np.float64)
+
+
+class BatchScorer(object):
+    """ Scores consecutive batches of a stream with one set of models
+
+    Batches are passed as arrays of shape (n_rows, n_sensors) holding the
+    values of sensors, and only the first one is checked (see check_batch).
+    score() and update() take the later ones as float64 arrays, which the
+    caller converts once per batch if need be (see as_values). The models are
+    trained on first_values, or restored from checkpoint with resume. Each
+    batch is scored with score() and then learnt from with update(), which
+    fits the models on the first batch and updates them on every later one.
+    If a checkpoint path is given, the model state is saved there every
+    checkpoint_interval seconds and by finish(). close() frees
+    the models, e.g. the worker processes of a sharded detector.
+    """
+
+    def __init__(self, sensors, detector, first_values, n_jobs=1,
+                 checkpoint=None, checkpoint_interval=60.0, resume=False):
+        self.sensors = list(sensors)
+        self.checkpoint = checkpoint
+        first_values = check_batch(first_values, len(self.sensors))
+
+        state, n_rows = None, 0
+        if resume:
+            from .checkpoint import load_checkpoint
+
+            state, metadata = load_checkpoint(checkpoint, detector,
+                                              self.sensors)
+            n_rows = metadata['rows']
+            print('Resuming from {} ({} rows seen)'.format(checkpoint,
+                                                           n_rows))
+
+        # Initialize anomaly detector models, train using first batch
+        self.model = init_detector_models(self.sensors, first_values,
+                                          detector, n_jobs, state)
+        self.first_pass = state is None
+        if checkpoint:
+            from .checkpoint import Checkpointer
+
+            self.checkpointer = Checkpointer(checkpoint, detector,
+                                             self.sensors,
+                                             checkpoint_interval, n_rows)
+
+    @staticmethod
+    def as_values(values):
+        """ The values of a batch as the float64 array score() and update()
+            take, without a copy if they're float64 already """
+        return np.asarray(values, dtype=np.float64)
+
+    def score(self, values):
+        """ Scores and flags of shape (n_rows, n_sensors) for a batch """
+        with metrics.timed('score', len(values)):
+            return self.model.score_and_flag(values)
+
+    def update(self, values):
+        """ Learn from a batch once it's been scored """
+        with metrics.timed('update', len(values)):
+            if self.first_pass:
+                self.model.fit(values)
+            else:
+                self.model.update(values)
+        self.first_pass = False
+        if self.checkpoint:
+            self.checkpointer.update(self.model, len(values))
+
+    def finish(self):
+        """ Save the final checkpoint, once the batches run out """
+        if self.checkpoint:
+            self.checkpointer.save(self.model)
+
+    def close(self):
+        if hasattr(self.model, 'close'):
+            self.model.close()
+
+
+def score_batches(batches, sensors, detector, n_jobs=1, checkpoint=None,
+                  checkpoint_interval=60.0, resume=False, skip_seen=True):
+    """ Score an iterable of dataframe batches
+
+    The models are trained on the first batch, which is scored in-sample,
+    and every later batch is scored before the models are updated with it.
+    Yields (batch, scores, flags), where scores and flags are arrays of
+    shape (n_rows, n_sensors) in the order of sensors.
+
+    If a checkpoint path is given, the model state is saved there every
+    checkpoint_interval seconds and once the batches run out. With resume,
+    the models start from the state saved in checkpoint instead of being
+    trained, so every batch is scored out of sample. Unless skip_seen is
+    False, e.g. for a live source whose rows are all new, the rows that the
+    checkpoint was saved after are taken to be the first ones of batches,
+    and skipped.
+    """
+    if resume and skip_seen:
+        batches = skip_seen_rows(batches, checkpoint)
+    batches = iter(batches)
+    with metrics.timed('read') as timer:
+        batch = next(batches, None)
+        if batch is None:
+            return
+        timer.rows = batch.shape[0]
+
+    sensors = list(sensors)
+    scorer = BatchScorer(sensors, detector, batch[sensors].values, n_jobs,
+                         checkpoint, checkpoint_interval, resume)
+    try:
+        while batch is not None:
+            values = scorer.as_values(batch[sensors].values)
+            scores, flags = scorer.score(values)
+            yield batch, scores, flags
+            scorer.update(values)
+
+            with metrics.timed('read') as timer:
+                batch = next(batches, None)
+                if batch is not None:
+                    timer.rows = batch.shape[0]
+
+        scorer.finish()
+    finally:
+        scorer.close()
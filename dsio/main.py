@@ -5,146 +5,198 @@
 4. Restreams input data and scores to ElasticSearch and/or Bokeh server
 """
 
+import os
 import sys
-import datetime
-import time
-import threading
-import math
+import asyncio
 import webbrowser
 
-from queue import Queue
-
 import numpy as np
 import pandas as pd
 
-from bokeh.plotting import curdoc
+# The Elasticsearch, Kibana and Bokeh backends are slow to import, so they
+# are only imported once the selected options need them
+from .restream.pipeline import restream, MAX_PENDING
+
+from .helpers import parse_arguments, parse_score_arguments
+from .helpers import normalize_timefield, normalize_chunks
+from .helpers import select_sensors, load_detector, iter_batches
 
-from .restream.elastic import init_elasticsearch
-from .restream.elastic import upload_dataframe
-from .dashboard.kibana import generate_dashboard as generate_kibana_dashboard
-from .dashboard.bokeh import generate_dashboard as generate_bokeh_dashboard
+from .sources import is_live_source, open_source
+from .broadcast import Broadcast
 
-from .helpers import parse_arguments, normalize_timefield
-from .helpers import select_sensors, init_detector_models, load_detector
+from . import metrics
 
-from .exceptions import DsioError
+from .exceptions import DsioError, CheckpointError
 
 MAX_BATCH_SIZE = 1000
-doc = curdoc()
+ES_WORKERS = 4
 
 
 def restream_dataframe(
         dataframe, detector, sensors=None, timefield=None,
         speed=10, es_uri=None, kibana_uri=None, index_name='',
-        entry_type='', bokeh_port=5001, cols=3):
+        entry_type='', bokeh_port=5001, cols=3, batch_size=MAX_BATCH_SIZE,
+        max_batches=MAX_PENDING, es_workers=ES_WORKERS,
+        realtime=True, n_jobs=1, cache_key=None, checkpoint=None,
+        checkpoint_interval=60.0, resume=False, dtype=np.float64,
+        skip_seen=True):
     """
         Restream selected sensors & anomaly detector scores from an input
         pandas dataframe to an existing Elasticsearch instance and/or to a
         built-in Bokeh server.
 
+        The input can also be an iterable of dataframe chunks, such as
+        pd.read_csv(..., chunksize=batch_size), in which case it's read
+        lazily. At most max_batches batches wait between any two stages of
+        the pipeline (see dsio.restream.pipeline).
+
+        If realtime is False the data is replayed as fast as possible,
+        e.g. to backfill Elasticsearch. With n_jobs > 1 the sensors are
+        scored in that many processes. If a cache_key is given (e.g. the
+        input file path), the detected time dimension is cached under it.
+        The detector state is saved to the checkpoint file, if any, every
+        checkpoint_interval seconds, and with resume scoring starts from
+        the state saved there instead of refitting, skipping the rows seen
+        before the checkpoint unless skip_seen is False (e.g. for a live
+        source, whose rows are all new). The values of the
+        sensors and their scores are restreamed as dtype, e.g. np.float32
+        to halve the memory they take.
+
         Generates respective Kibana & Bokeh dashboard apps to visualize the
-        stream in the browser
+        stream in the browser. Blocks until the stream ends, unless an event
+        loop is already running (e.g. in a Jupyter notebook), in which case
+        the restream is scheduled on it and the task is returned.
     """
 
-    dataframe, timefield, available_sensors = normalize_timefield(
-        dataframe, timefield, speed
-    )
+    if isinstance(dataframe, pd.DataFrame):
+        dataframe, timefield, available_sensors = normalize_timefield(
+            dataframe, timefield, speed, cache_key
+        )
 
-    dataframe, sensors = select_sensors(
-        dataframe, sensors, available_sensors, timefield
-    )
+        dataframe, sensors = select_sensors(
+            dataframe, sensors, available_sensors, timefield
+        )
+        batches = iter_batches(dataframe, batch_size)
+    else:
+        batches, timefield, sensors = normalize_chunks(
+            dataframe, timefield, sensors, speed, cache_key
+        )
 
     if es_uri:
-        es_conn = init_elasticsearch(es_uri)
+        from .restream.elastic import init_elasticsearch, BulkWriter
+        from .dashboard.kibana import generate_dashboard \
+            as generate_kibana_dashboard
+
+        es_conn = init_elasticsearch(es_uri, pool_size=es_workers)
         # Generate dashboard with selected fields and scores
         generate_kibana_dashboard(es_conn, sensors, index_name)
         webbrowser.open(kibana_uri+'#/dashboard/%s-dashboard' % index_name)
+        # Upload to Elasticsearch without stalling the replay
+        es_writer = BulkWriter(es_conn, index_name, entry_type,
+                               workers=es_workers)
     else:
-        es_conn = None
-
-    # Queue to communicate between restreamer and dashboard threads
-    update_queue = Queue()
-    if bokeh_port:
-        generate_bokeh_dashboard(
-            sensors, title=detector.__name__, cols=cols,
-            port=bokeh_port, update_queue=update_queue
+        es_writer = None
+
+    # Scored rows, for any number of dashboards to read
+    broadcast = Broadcast() if bokeh_port else None
+
+    try: # e.g. in a Jupyter notebook
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+
+    async def run():
+        """ Serve the dashboard and restream on the same event loop """
+        server = None
+        if bokeh_port:
+            from .dashboard.bokeh import generate_dashboard \
+                as generate_bokeh_dashboard
+
+            server = generate_bokeh_dashboard(
+                sensors, title=detector.__name__, cols=cols,
+                port=bokeh_port, broadcast=broadcast,
+                notebook=loop is not None
+            )
+        try:
+            await restream(
+                batches, sensors, detector, timefield, es_writer=es_writer,
+                broadcast=broadcast, realtime=realtime, n_jobs=n_jobs,
+                checkpoint=checkpoint,
+                checkpoint_interval=checkpoint_interval, resume=resume,
+                max_pending=max_batches, dtype=dtype, skip_seen=skip_seen
+            )
+        finally:
+            if server:
+                server.stop()
+
+    if loop is None:
+        asyncio.run(run())
+    else: # leave the loop that's already running to it
+        return loop.create_task(run())
+
+
+def score_main(argv=None):
+    """ Score an input file offline: `dsio score input output` """
+    args = parse_score_arguments(argv)
+
+    try:
+        if args.resume and not args.checkpoint:
+            raise CheckpointError('--resume needs a --checkpoint file')
+        detector = load_detector(args.detector, args.modules)
+
+        from .offline import score_file
+
+        n_rows, rate = score_file(
+            args.input, args.output, detector, sensors=args.sensors,
+            timefield=args.timefield, batch_size=int(args.batch_size),
+            n_jobs=int(args.jobs), checkpoint=args.checkpoint,
+            checkpoint_interval=float(args.checkpoint_interval),
+            resume=args.resume
         )
+        print('Done. Scored {} rows at {:.0f} rows/sec'.format(n_rows, rate))
 
-    restream_thread = threading.Thread(
-        target=threaded_restream_dataframe,
-        args=(dataframe, sensors, detector, timefield, es_conn,
-              index_name, entry_type, bokeh_port, update_queue)
-    )
-    restream_thread.start()
-
-
-def threaded_restream_dataframe(dataframe, sensors, detector, timefield,
-                                es_conn, index_name, entry_type, bokeh_port,
-                                update_queue, interval=3, sleep_interval=1):
-    """ Restream dataframe to bokeh and/or Elasticsearch """
-    # Split data into batches
-    batches = np.array_split(dataframe, math.ceil(dataframe.shape[0]/MAX_BATCH_SIZE))
-
-    # Initialize anomaly detector models, train using first batch
-    models = init_detector_models(sensors, batches[0], detector)
-
-    first_pass = True
-    for batch in batches:
-        for sensor in sensors: # Apply the scores
-            batch['SCORE_{}'.format(sensor)] = models[sensor].score_anomaly(batch[sensor])
-            batch['FLAG_{}'.format(sensor)] = models[sensor].flag_anomaly(batch[sensor])
-
-        end_time = np.min(batch[timefield])
-        recreate_index = first_pass
-
-        while end_time < np.max(batch[timefield]):
-            start_time = end_time
-            end_time += interval*1000
-            if not recreate_index:
-                while np.round(time.time()) < end_time/1000.:
-                    sys.stdout.write('.')
-                    sys.stdout.flush()
-                    time.sleep(sleep_interval)
-
-            ind = np.logical_and(batch[timefield] <= end_time,
-                                 batch[timefield] > start_time)
-            print('\nWriting {} rows dated {} to {}'
-                    .format(np.sum(ind),
-                            datetime.datetime.fromtimestamp(start_time/1000.),
-                            datetime.datetime.fromtimestamp(end_time/1000.)))
-
-            if bokeh_port:
-                update_queue.put(batch.loc[ind])
-
-            if es_conn: # Stream batch to Elasticsearch
-                upload_dataframe(es_conn, batch.loc[ind], index_name, entry_type,
-                                 recreate=recreate_index)
-            recreate_index = False
-
-        if first_pass:
-            for sensor in sensors:  # Fit the models
-                models[sensor].fit(batch[sensor])
-        else:
-            for sensor in sensors:  # Update the models
-                models[sensor].update(batch[sensor])
-        first_pass = False
+    except DsioError as exc:
+        print(repr(exc))
+        sys.exit(exc.code)
 
 
 def main():
     """ Main function """
+    if sys.argv[1:2] == ['score']:
+        return score_main(sys.argv[2:])
+
     args = parse_arguments()
 
+    if args.metrics_port:
+        metrics.serve_prometheus(int(args.metrics_port))
+    if args.metrics_interval:
+        metrics.log_periodically(float(args.metrics_interval))
+
     try:
+        if args.resume and not args.checkpoint:
+            raise CheckpointError('--resume needs a --checkpoint file')
         detector = load_detector(args.detector, args.modules)
 
         # Generate index name from input filename
         index_name = args.input.split('/')[-1].split('.')[0].split('_')[0]
-        if not index_name:
+        if not index_name or is_live_source(args.input):
             index_name = 'dsio'
 
-        print('Loading the data...')
-        dataframe = pd.read_csv(args.input, sep=',')
-        print('Done.\n')
+        batch_size = int(args.batch_size)
+        # Input files remember their detected time format between runs
+        cache_key = None if is_live_source(args.input) \
+            else os.path.abspath(args.input)
+        if args.follow or is_live_source(args.input):
+            dataframe = open_source(
+                args.input, fmt=args.format, batch_size=batch_size,
+                max_wait=float(args.max_wait), follow=args.follow
+            )
+        elif args.chunked:
+            dataframe = pd.read_csv(args.input, sep=',', chunksize=batch_size)
+        else:
+            print('Loading the data...')
+            dataframe = pd.read_csv(args.input, sep=',')
+            print('Done.\n')
 
         restream_dataframe(
             dataframe=dataframe, detector=detector,
@@ -152,7 +204,14 @@ def main():
             speed=int(float(args.speed)), es_uri=args.es and args.es_uri,
             kibana_uri=args.kibana_uri, index_name=index_name,
             entry_type=args.entry_type, bokeh_port=int(args.bokeh_port),
-            cols=int(args.cols)
+            cols=int(args.cols), batch_size=batch_size,
+            max_batches=int(args.max_batches),
+            es_workers=int(args.es_workers), realtime=not args.fast,
+            n_jobs=int(args.jobs), cache_key=cache_key,
+            checkpoint=args.checkpoint,
+            checkpoint_interval=float(args.checkpoint_interval),
+            resume=args.resume, skip_seen=not is_live_source(args.input),
+            dtype=np.float32 if args.float32 else np.float64
         )
 
     except DsioError as exc:
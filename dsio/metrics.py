@@ -0,0 +1,242 @@
+"""
+Pipeline instrumentation
+
+Collects per-stage timers (calls, seconds and rows), queue depths and the
+lag between the time of the latest event and the wall clock, so that a
+replay that falls behind shows whether reading, scoring, the dashboard or
+Elasticsearch is the bottleneck.
+
+Instrumentation is off until enable() is called. Until then timed() returns
+a shared no-op context manager and the other functions return straight
+away, so the instrumented code pays for a global lookup and little else.
+Once enabled, the metrics can be served in the Prometheus text format with
+serve_prometheus() or logged as JSON lines with log_periodically().
+"""
+
+import json
+import sys
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+_registry = None
+
+
+class Registry(object):
+    """ Thread safe store of stage timers, counters and gauges """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        # stage -> [calls, seconds, max seconds, rows]
+        self.stages = {}
+        # (name, sorted label items) -> value
+        self.gauges = {}
+
+    def observe(self, stage, seconds, rows=0):
+        with self.lock:
+            timer = self.stages.get(stage)
+            if timer is None:
+                timer = self.stages[stage] = [0, 0.0, 0.0, 0]
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+            timer[3] += rows
+
+    def set_gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def snapshot(self):
+        """ A JSON serializable copy of every metric """
+        with self.lock:
+            stages = {stage: list(timer)
+                      for stage, timer in self.stages.items()}
+            gauges = dict(self.gauges)
+        elapsed = time.time() - self.started
+        return {
+            'time': time.time(),
+            'uptime': elapsed,
+            'stages': {
+                stage: {
+                    'calls': calls, 'seconds': seconds, 'max_seconds': peak,
+                    'rows': rows,
+                    'rows_per_sec': rows / elapsed if elapsed else 0.0,
+                }
+                for stage, (calls, seconds, peak, rows) in stages.items()
+            },
+            'gauges': {
+                _gauge_key(name, labels): value
+                for (name, labels), value in gauges.items()
+            },
+        }
+
+    def prometheus_text(self):
+        """ Render every metric in the Prometheus text exposition format """
+        with self.lock:
+            stages = sorted(self.stages.items())
+            gauges = sorted(self.gauges.items())
+
+        lines = []
+        for metric, index, kind, doc in [
+                ('dsio_stage_calls_total', 0, 'counter',
+                 'Number of times each pipeline stage ran'),
+                ('dsio_stage_seconds_total', 1, 'counter',
+                 'Seconds spent in each pipeline stage'),
+                ('dsio_stage_seconds_max', 2, 'gauge',
+                 'Longest single run of each pipeline stage'),
+                ('dsio_stage_rows_total', 3, 'counter',
+                 'Rows processed by each pipeline stage')]:
+            lines.append('# HELP %s %s' % (metric, doc))
+            lines.append('# TYPE %s %s' % (metric, kind))
+            for stage, timer in stages:
+                lines.append('%s{stage="%s"} %s' % (metric, stage,
+                                                    timer[index]))
+
+        seen = set()
+        for (name, labels), value in gauges:
+            metric = 'dsio_%s' % name
+            if metric not in seen:
+                lines.append('# TYPE %s gauge' % metric)
+                seen.add(metric)
+            label_text = ','.join('%s="%s"' % item for item in labels)
+            lines.append('%s{%s} %s' % (metric, label_text, value)
+                         if label_text else '%s %s' % (metric, value))
+        return '\n'.join(lines) + '\n'
+
+
+def _gauge_key(name, labels):
+    if not labels:
+        return name
+    return '%s{%s}' % (name, ','.join('%s=%s' % item for item in labels))
+
+
+class _Timer(object):
+    """ Times a block of code as one run of stage. The number of rows it
+        processed can be set on the timer before the block exits. """
+
+    __slots__ = ('stage', 'rows', 'start')
+
+    def __init__(self, stage, rows):
+        self.stage = stage
+        self.rows = rows
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        registry = _registry
+        if registry is not None:
+            registry.observe(self.stage, time.perf_counter() - self.start,
+                             self.rows)
+        return False
+
+
+class _NullTimer(object):
+    """ Stands in for _Timer while instrumentation is disabled """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def enable():
+    """ Start collecting metrics and return the registry """
+    global _registry
+    if _registry is None:
+        _registry = Registry()
+    return _registry
+
+
+def disable():
+    global _registry
+    _registry = None
+
+
+def enabled():
+    return _registry is not None
+
+
+def timed(stage, rows=0):
+    """ Context manager that times its block as a run of stage """
+    if _registry is None:
+        return _NULL_TIMER
+    return _Timer(stage, rows)
+
+
+def observe(stage, seconds, rows=0):
+    """ Record a run of stage that was timed elsewhere """
+    registry = _registry
+    if registry is not None:
+        registry.observe(stage, seconds, rows)
+
+
+def gauge(name, value, **labels):
+    """ Set the current value of a gauge, e.g. a queue depth """
+    registry = _registry
+    if registry is not None:
+        registry.set_gauge(name, value, **labels)
+
+
+def event_lag(stage, event_time_ms):
+    """ Record how far behind the wall clock the events reaching stage are,
+        given the timestamp of the latest one in milliseconds """
+    registry = _registry
+    if registry is not None:
+        registry.set_gauge('event_lag_seconds',
+                           time.time() - event_time_ms / 1000., stage=stage)
+
+
+def serve_prometheus(port, host=''):
+    """ Serve the metrics in the Prometheus text format on /metrics from a
+        background thread """
+    registry = enable()
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type',
+                             'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args): # keep scrapes out of the console
+            pass
+
+    server = HTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def log_periodically(interval, stream=None):
+    """ Write a JSON snapshot of the metrics to stream (stderr by default)
+        every interval seconds from a background thread """
+    registry = enable()
+    stream = stream or sys.stderr
+
+    def log():
+        while True:
+            time.sleep(interval)
+            stream.write(json.dumps(registry.snapshot()) + '\n')
+            stream.flush()
+
+    thread = threading.Thread(target=log, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,184 @@
+"""
+Headless batch scoring
+
+`dsio score` runs the selected anomaly detector over a whole input file as
+fast as the CPU allows, without replaying it, and streams the sensor values,
+SCORE_* and FLAG_* columns chunk by chunk to one of:
+
+    output.parquet           Parquet file (needs pyarrow)
+    output.arrow / .feather  Arrow IPC file (needs pyarrow)
+    output_dir               directory of memory-mappable .npy files
+"""
+
+import json
+import os
+import struct
+import time
+
+import numpy as np
+import pandas as pd
+
+from .exceptions import ModuleLoadError
+from .helpers import normalize_chunks, score_batches
+
+NPY_HEADER_SIZE = 128
+
+
+class NpyAppender(object):
+    """
+    Appends rows to a .npy file of unknown final length
+
+    A fixed size header is reserved up front and rewritten with the final
+    shape on close, so the result can be opened with
+    np.load(path, mmap_mode='r').
+    """
+
+    def __init__(self, path, dtype, n_columns):
+        self.dtype = np.dtype(dtype)
+        self.n_columns = n_columns
+        self.n_rows = 0
+        self.file = open(path, 'wb')
+        self._write_header()
+
+    def _write_header(self):
+        if self.n_columns is None:
+            shape = (self.n_rows,)
+        else:
+            shape = (self.n_rows, self.n_columns)
+        header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (
+            np.lib.format.dtype_to_descr(self.dtype), shape
+        )
+        # magic string, version 1.0, header length, space padded header
+        header_length = NPY_HEADER_SIZE - 10
+        self.file.seek(0)
+        self.file.write(b'\x93NUMPY\x01\x00')
+        self.file.write(struct.pack('<H', header_length))
+        self.file.write(header.ljust(header_length - 1).encode('latin1'))
+        self.file.write(b'\n')
+        self.file.seek(0, os.SEEK_END)
+
+    def append(self, rows):
+        rows = np.ascontiguousarray(rows, dtype=self.dtype)
+        self.file.write(rows.tobytes())
+        self.n_rows += rows.shape[0]
+
+    def close(self):
+        self._write_header()
+        self.file.close()
+
+
+class NpyWriter(object):
+    """ Writes time, values, scores and flags as .npy files in a directory,
+        along with the sensor order of their columns """
+
+    def __init__(self, path, timefield, sensors):
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'sensors.json'), 'w') as sensors_file:
+            json.dump(sensors, sensors_file)
+        self.timefield = timefield
+        self.sensors = sensors
+        self.files = {
+            'time': NpyAppender(os.path.join(path, 'time.npy'),
+                                np.int64, None),
+            'values': NpyAppender(os.path.join(path, 'values.npy'),
+                                  np.float64, len(sensors)),
+            'scores': NpyAppender(os.path.join(path, 'scores.npy'),
+                                  np.float64, len(sensors)),
+            'flags': NpyAppender(os.path.join(path, 'flags.npy'),
+                                 np.bool_, len(sensors)),
+        }
+
+    def write(self, batch, scores, flags):
+        self.files['time'].append(batch[self.timefield].values)
+        self.files['values'].append(batch[self.sensors].values)
+        self.files['scores'].append(scores)
+        self.files['flags'].append(flags)
+
+    def close(self):
+        for appender in self.files.values():
+            appender.close()
+
+
+class ArrowWriter(object):
+    """ Writes time, sensor, SCORE_* and FLAG_* columns to a Parquet or
+        Arrow IPC file, one record batch per scored batch """
+
+    def __init__(self, path, timefield, sensors, parquet=True):
+        try:
+            import pyarrow
+            import pyarrow.ipc
+            import pyarrow.parquet
+        except ImportError as exc:
+            raise ModuleLoadError('pyarrow is needed to write %s' % path, exc)
+        self.pa = pyarrow
+        self.timefield = timefield
+        self.sensors = sensors
+        self.schema = pyarrow.schema(
+            [(timefield, pyarrow.int64())] +
+            [(sensor, pyarrow.float64()) for sensor in sensors] +
+            [('SCORE_%s' % sensor, pyarrow.float64()) for sensor in sensors] +
+            [('FLAG_%s' % sensor, pyarrow.bool_()) for sensor in sensors]
+        )
+        if parquet:
+            self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        else:
+            self.writer = pyarrow.ipc.new_file(path, self.schema)
+
+    def write(self, batch, scores, flags):
+        values = batch[self.sensors].values.astype(np.float64)
+        columns = [batch[self.timefield].values.astype(np.int64)]
+        columns += [values[:, i] for i in range(len(self.sensors))]
+        columns += [scores[:, i] for i in range(len(self.sensors))]
+        columns += [flags[:, i] for i in range(len(self.sensors))]
+        self.writer.write_batch(self.pa.RecordBatch.from_arrays(
+            [self.pa.array(column) for column in columns], schema=self.schema
+        ))
+
+    def close(self):
+        self.writer.close()
+
+
+def open_writer(path, timefield, sensors):
+    """ Pick the output writer from the extension of path """
+    if path.endswith('.parquet'):
+        return ArrowWriter(path, timefield, sensors, parquet=True)
+    if path.endswith(('.arrow', '.feather')):
+        return ArrowWriter(path, timefield, sensors, parquet=False)
+    return NpyWriter(path, timefield, sensors)
+
+
+def score_file(input_path, output_path, detector, sensors=None, timefield='',
+               batch_size=10000, n_jobs=1, checkpoint=None,
+               checkpoint_interval=60.0, resume=False):
+    """ Score every row of a CSV file and stream the results to output_path
+
+        The detector state can be checkpointed and resumed from like in
+        score_batches.
+
+        Returns the number of rows scored and the rows per second achieved.
+    """
+    chunks = pd.read_csv(input_path, sep=',', chunksize=batch_size)
+    batches, timefield, sensors = normalize_chunks(
+        chunks, timefield, sensors, cache_key=os.path.abspath(input_path),
+        replay=False
+    )
+    sensors = sorted(sensors)
+    writer = open_writer(output_path, timefield, sensors)
+
+    n_rows = 0
+    start = time.time()
+    try:
+        for batch, scores, flags in score_batches(
+                batches, sensors, detector, n_jobs, checkpoint=checkpoint,
+                checkpoint_interval=checkpoint_interval, resume=resume):
+            writer.write(batch, scores, flags)
+            n_rows += batch.shape[0]
+            elapsed = time.time() - start
+            print('Scored {} rows ({:.0f} rows/sec)'.format(
+                n_rows, n_rows / elapsed if elapsed else float('inf')))
+    finally:
+        writer.close()
+
+    elapsed = time.time() - start
+    rate = n_rows / elapsed if elapsed else float('inf')
+    return n_rows, rate
@@ -0,0 +1,274 @@
+"""
+Sharded scoring across CPU cores
+
+ShardedDetector partitions the sensors across a pool of worker processes.
+Each worker owns the detector state of its shard for the whole stream, and
+batches and scores move between processes through shared memory, so only
+short commands are pickled.
+"""
+
+import multiprocessing
+import pickle
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .anomaly_detectors import PerSensorDetector
+from .exceptions import ScoringWorkerError
+from .helpers import LOADED_MODULES, load_modules
+
+
+def _as_arrays(blocks, capacity, n_sensors):
+    """ View the shared input, score and flag blocks as arrays, with the
+        columns of each shard contiguous in memory """
+    shape = (capacity, n_sensors)
+    return (
+        np.ndarray(shape, dtype=np.float64, buffer=blocks[0].buf, order='F'),
+        np.ndarray(shape, dtype=np.float64, buffer=blocks[1].buf, order='F'),
+        np.ndarray(shape, dtype=np.bool_, buffer=blocks[2].buf, order='F'),
+    )
+
+
+def _attach(names, capacity, n_sensors):
+    """ Map the shared blocks created by the parent process """
+    blocks = [shared_memory.SharedMemory(name=name) for name in names]
+    return blocks, _as_arrays(blocks, capacity, n_sensors)
+
+
+def _shard_worker(conn, modules, detector, columns, names, capacity,
+                  n_sensors):
+    """ Serve fit/update/score commands for the sensors in columns, after
+        reporting whether the worker could start
+
+        The worker starts from a fresh interpreter, so it loads the modules
+        the detector may be defined in before unpickling it.
+    """
+    try:
+        load_modules(modules)
+        detector = pickle.loads(detector)
+        if detector._columnwise:
+            model = detector()
+        else:
+            model = PerSensorDetector(detector, columns.stop - columns.start)
+        blocks, (values, scores, flags) = _attach(names, capacity, n_sensors)
+    except Exception as exc:
+        conn.send(('error', repr(exc)))
+        conn.close()
+        return
+    conn.send(('ok', None))
+
+    while True:
+        try:
+            command, arg = conn.recv()
+        except EOFError: # the parent went away without stopping us
+            break
+        result = None
+        try:
+            if command == 'stop':
+                break
+            elif command == 'attach':
+                values = scores = flags = None
+                for block in blocks:
+                    block.close()
+                names, capacity = arg
+                blocks, (values, scores, flags) = _attach(
+                    names, capacity, n_sensors
+                )
+            # models may keep the data they're fitted on, so they get a copy
+            # that the next batch can't overwrite
+            elif command == 'fit':
+                model.fit(np.array(values[:arg, columns]))
+            elif command == 'update':
+                model.update(np.array(values[:arg, columns]))
+            elif command == 'score':
+                scores[:arg, columns], flags[:arg, columns] = \
+                    model.score_and_flag(values[:arg, columns])
+            elif command == 'get_state':
+                result = model.get_state()
+            elif command == 'set_state':
+                model.set_state(arg)
+            conn.send(('ok', result))
+        except Exception as exc:
+            conn.send(('error', repr(exc)))
+
+    values = scores = flags = None
+    for block in blocks:
+        block.close()
+    conn.close()
+
+
+class ShardedDetector(object):
+    """
+    Exposes the columnwise detector interface over n_jobs worker processes,
+    each of which scores a contiguous shard of the sensors.
+    """
+
+    def __init__(self, detector, n_sensors, n_jobs, capacity=1000):
+        # forking could copy locks held by the threads of the pipeline, so
+        # the workers start from a fresh interpreter and load --modules
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('forkserver')
+            # the server imports the detectors once, not every worker
+            context.set_forkserver_preload(['__main__', __name__])
+        else:
+            context = multiprocessing.get_context('spawn')
+        self.n_sensors = n_sensors
+        self.capacity = 0
+        self.blocks = []
+        self._allocate(capacity)
+
+        self.connections = []
+        self.workers = []
+        self.shards = [
+            slice(int(shard[0]), int(shard[-1]) + 1) for shard in
+            np.array_split(np.arange(n_sensors), min(n_jobs, n_sensors))
+        ]
+        try:
+            for shard in self.shards:
+                parent_conn, child_conn = context.Pipe()
+                self.connections.append(parent_conn)
+                worker = context.Process(
+                    target=_shard_worker, daemon=True,
+                    args=(child_conn, list(LOADED_MODULES),
+                          pickle.dumps(detector), shard, self.names,
+                          self.capacity, n_sensors)
+                )
+                worker.start()
+                child_conn.close()
+                self.workers.append(worker)
+        except Exception as exc:
+            self._abort()
+            raise ScoringWorkerError('cannot start worker: %r' % exc, exc)
+        try:
+            self._receive()
+        except ScoringWorkerError:
+            self._abort()
+            raise
+
+    def _allocate(self, capacity):
+        """ Create shared blocks for batches of up to capacity rows and
+            return the ones they replace """
+        size = capacity * self.n_sensors
+        old_blocks = self.blocks
+        self.blocks = [
+            shared_memory.SharedMemory(create=True, size=max(8*size, 1)),
+            shared_memory.SharedMemory(create=True, size=max(8*size, 1)),
+            shared_memory.SharedMemory(create=True, size=max(size, 1)),
+        ]
+        self.names = [block.name for block in self.blocks]
+        self.capacity = capacity
+        self.values, self.scores, self.flags = _as_arrays(
+            self.blocks, capacity, self.n_sensors
+        )
+        return old_blocks
+
+    @staticmethod
+    def _release(blocks):
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    def _abort(self):
+        """ Kill the workers and release the shared memory after a worker
+            died or couldn't start, when they can't be stopped in order """
+        for worker in self.workers:
+            worker.terminate()
+            worker.join()
+        for conn in self.connections:
+            conn.close()
+        self.connections = []
+        self.workers = []
+        self.values = self.scores = self.flags = None
+        self._release(self.blocks)
+        self.blocks = []
+
+    def _receive(self):
+        """ Collect the reply of every worker and return their results,
+            raising the first error any of them reported """
+        replies = []
+        try:
+            for conn in self.connections:
+                replies.append(conn.recv())
+        except (OSError, EOFError) as exc:
+            self._abort()
+            raise ScoringWorkerError('lost connection to worker: %r' % exc,
+                                     exc)
+        for status, result in replies:
+            if status == 'error':
+                raise ScoringWorkerError(result)
+        return [result for _, result in replies]
+
+    def _broadcast(self, command, arg=None, args=None):
+        """ Send a command to every worker, with either the same arg or one
+            of args each, and return their results """
+        if not self.connections:
+            raise ScoringWorkerError('workers were stopped')
+        if args is None:
+            args = [arg] * len(self.connections)
+        try:
+            for conn, arg in zip(self.connections, args):
+                conn.send((command, arg))
+        except OSError as exc:
+            self._abort()
+            raise ScoringWorkerError('lost connection to worker: %r' % exc,
+                                     exc)
+        return self._receive()
+
+    def _load(self, X):
+        if not self.connections:
+            raise ScoringWorkerError('workers were stopped')
+        X = np.asarray(X, dtype=np.float64)
+        n_rows = X.shape[0]
+        if n_rows > self.capacity:
+            old_blocks = self._allocate(max(n_rows, 2 * self.capacity))
+            try:
+                self._broadcast('attach', (self.names, self.capacity))
+            finally:
+                self._release(old_blocks)
+        self.values[:n_rows] = X
+        return n_rows
+
+    def fit(self, X):
+        self._broadcast('fit', self._load(X))
+
+    def update(self, X):
+        self._broadcast('update', self._load(X))
+
+    def score_and_flag(self, X):
+        n_rows = self._load(X)
+        self._broadcast('score', n_rows)
+        return self.scores[:n_rows].copy(), self.flags[:n_rows].copy()
+
+    def get_state(self):
+        """ Gather the state of every shard, with the sensors on the last
+            axis of each array as in a single process """
+        states = self._broadcast('get_state')
+        return {
+            name: states[0][name] if np.ndim(states[0][name]) == 0 else
+            np.concatenate([state[name] for state in states], axis=-1)
+            for name in states[0]
+        }
+
+    def set_state(self, state):
+        self._broadcast('set_state', args=[
+            {name: value if np.ndim(value) == 0 else value[..., shard]
+             for name, value in state.items()}
+            for shard in self.shards
+        ])
+
+    def close(self):
+        """ Stop the workers and release the shared memory """
+        try:
+            for conn in self.connections:
+                conn.send(('stop', None))
+        except OSError:
+            self._abort()
+            return
+        for worker in self.workers:
+            worker.join()
+        self.connections = []
+        self.workers = []
+        self.values = self.scores = self.flags = None
+        self._release(self.blocks)
+        self.blocks = []
@@ -3,20 +3,27 @@ Elasticsearch batch re-streamer
 """
 import time
 import datetime
-import sys
+import json
+import threading
+
+from collections import deque
+from queue import Queue
 
 import numpy as np
 
 import elasticsearch
 
-from elasticsearch.helpers import bulk
-
+from .scheduler import replay_windows, wait_until
+from .. import metrics
 from ..exceptions import ElasticsearchConnectionError
 
+MAX_CHUNK_DOCS = 1000
+MAX_CHUNK_BYTES = 5 * 1024 * 1024
+
 
-def init_elasticsearch(uri):
-    # init ElasticSearch
-    es_conn = elasticsearch.Elasticsearch(uri)
+def init_elasticsearch(uri, pool_size=10):
+    # init ElasticSearch, with enough pooled connections for every writer
+    es_conn = elasticsearch.Elasticsearch(uri, maxsize=pool_size)
     try:
         es_conn.info()
     except elasticsearch.ConnectionError:
@@ -32,66 +39,288 @@ def batch_redater(dataframe, timefield, frequency=10):
     return dataframe
 
 
-def upload_dataframe(es_conn, dataframe, index_name, entry_type,
-                     recreate=False, chunk_size=100):
-    """ Upload dataframe to Elasticsearch """
-    # Make sure previous indices with similar name are erased and create a new index
-    if recreate:
-        try:
-            es_conn.indices.delete(index_name)
-            print('Deleting existing index {}'.format(index_name))
-        except elasticsearch.TransportError:
-            pass
-
-        print('Creating index {}'.format(index_name))
-        es_conn.indices.create(index_name, body={
-            "mappings": {
-                index_name: {
-                    "properties": {
-                        "time" : {
-                            "type": "date"
-                        }
+def serialize_dataframe(dataframe):
+    """ Serialize every row of a dataframe to a JSON document
+
+        Encodes the column arrays directly, without transposing the dataframe
+        or building a dictionary per row, and returns a list of strings.
+        Floats are written with repr, like json.dumps does, so they round
+        trip exactly; pandas' encoder would cap them at 15 digits.
+        Missing values are sent as 0, like they have always been.
+    """
+    if dataframe.isnull().values.any():
+        dataframe = dataframe.fillna(0)
+    columns = []
+    for name, column in dataframe.items():
+        key = json.dumps(str(name)) + ':'
+        kind = column.dtype.kind
+        if kind == 'f':
+            values = column.values.astype(np.float64)
+            encode = repr if np.isfinite(values).all() else json.dumps
+        elif kind in 'iu':
+            values, encode = column.values, str
+        elif kind == 'b':
+            values, encode = column.values, json.dumps
+        else:
+            docs = dataframe[[name]].to_json(orient='records', lines=True)
+            columns.append([doc[1:-1] for doc in docs.splitlines()])
+            continue
+        columns.append([key + encode(value) for value in values.tolist()])
+    return ['{%s}' % ','.join(fields) for fields in zip(*columns)]
+
+
+def bulk_bodies(docs, action, chunk_size=MAX_CHUNK_DOCS,
+                max_chunk_bytes=MAX_CHUNK_BYTES):
+    """ Yield NDJSON bulk request bodies for a list of serialized documents
+
+        Each body pairs every document with the same action line and holds
+        at most chunk_size documents and roughly max_chunk_bytes bytes
+        (a single document larger than that still gets its own body).
+    """
+    if not docs:
+        return
+    # docs are ASCII (to_json escapes anything else) so length == size
+    line_sizes = np.fromiter(
+        (len(doc) for doc in docs), dtype=np.int64, count=len(docs)
+    ) + len(action) + 2
+    ends = np.cumsum(line_sizes)
+
+    start = 0
+    offset = 0
+    separator = '\n%s\n' % action
+    while start < len(docs):
+        stop = max(
+            np.searchsorted(ends, offset + max_chunk_bytes, side='right'),
+            start + 1
+        )
+        stop = min(stop, start + chunk_size)
+        yield '%s\n%s\n' % (action, separator.join(docs[start:stop]))
+        offset = ends[stop-1]
+        start = stop
+
+
+def recreate_index(es_conn, index_name):
+    """ Make sure previous indices with similar name are erased and create
+        a new index """
+    try:
+        es_conn.indices.delete(index_name)
+        print('Deleting existing index {}'.format(index_name))
+    except elasticsearch.TransportError:
+        pass
+
+    print('Creating index {}'.format(index_name))
+    es_conn.indices.create(index_name, body={
+        "mappings": {
+            index_name: {
+                "properties": {
+                    "time" : {
+                        "type": "date"
                     }
                 }
             }
-        })
+        }
+    })
+
+
+def bulk_action(index_name, entry_type):
+    """ The bulk action line shared by all the documents of an index """
+    return json.dumps({"index": {"_index": index_name, "_type": entry_type}})
+
+
+def upload_dataframe(es_conn, dataframe, index_name, entry_type,
+                     recreate=False, chunk_size=MAX_CHUNK_DOCS,
+                     max_chunk_bytes=MAX_CHUNK_BYTES):
+    """ Upload dataframe to Elasticsearch """
+    if recreate:
+        recreate_index(es_conn, index_name)
 
     ### Adding index name and type for all events:
-    dataframe.insert(1, '_index', index_name)
-    dataframe.insert(1, '_type', entry_type)
+    action = bulk_action(index_name, entry_type)
+
+    with metrics.timed('es_serialize', dataframe.shape[0]):
+        docs = serialize_dataframe(dataframe)
+
+    # Export to ES, one bulk request at a time
+    success, errors = 0, []
+    for body in bulk_bodies(docs, action, chunk_size, max_chunk_bytes):
+        with metrics.timed('es_bulk', body.count('\n') // 2):
+            response = es_conn.bulk(body=body)
+        for item in response['items']:
+            result = item['index']
+            if 200 <= result.get('status', 500) < 300:
+                success += 1
+            else:
+                errors.append(result)
+
+    return success, errors
+
+
+class BulkWriter(object):
+    """
+    Uploads dataframes to Elasticsearch asynchronously
+
+    write() serializes a dataframe into bulk request bodies and queues them
+    for a pool of worker threads sharing the connection pool of es_conn.
+    The queue is bounded, so write() blocks once max_pending requests are
+    waiting, which keeps a slow cluster from buffering data without bound.
+    Requests and individual documents rejected with HTTP 429 are retried
+    with exponential backoff.
+    """
 
-    # Format the batch to upload as a tuple of dictionaries
-    list_tmp = tuple(dataframe.fillna(0).T.to_dict().values())
+    def __init__(self, es_conn, index_name, entry_type, workers=4,
+                 max_pending=16, chunk_size=MAX_CHUNK_DOCS,
+                 max_chunk_bytes=MAX_CHUNK_BYTES, max_retries=8,
+                 initial_backoff=0.5, max_backoff=30.0):
+        self.es_conn = es_conn
+        self.index_name = index_name
+        self.action = bulk_action(index_name, entry_type)
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
 
-    # Export to ES
-    out = bulk(es_conn, list_tmp, chunk_size=chunk_size)
+        self.queue = Queue(maxsize=max_pending)
+        self.lock = threading.Lock()
+        self.counters = {
+            'docs': 0, 'bytes': 0, 'requests': 0, 'retries': 0,
+            'failed_docs': 0, 'latency_total': 0.0, 'latency_max': 0.0
+        }
+        self.errors = deque(maxlen=100)
+        self.started = time.time()
+        self.threads = [
+            threading.Thread(target=self._work, daemon=True)
+            for _ in range(workers)
+        ]
+        for thread in self.threads:
+            thread.start()
 
-    return out
+    def write(self, dataframe, recreate=False):
+        """ Queue dataframe for upload, blocking while the queue is full """
+        if recreate: # wait for pending writes to land in the old index first
+            self.flush()
+            recreate_index(self.es_conn, self.index_name)
+        with metrics.timed('es_serialize', dataframe.shape[0]):
+            docs = serialize_dataframe(dataframe)
+        for body in bulk_bodies(docs, self.action, self.chunk_size,
+                                self.max_chunk_bytes):
+            self.queue.put(body)
+        metrics.gauge('queue_depth', self.queue.qsize(),
+                      queue='elasticsearch')
+
+    def flush(self):
+        """ Block until every queued request has been sent """
+        self.queue.join()
+
+    def close(self):
+        """ Send all queued requests and stop the workers """
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def stats(self):
+        """ Throughput and latency counters since the writer started """
+        with self.lock:
+            counters = dict(self.counters)
+        elapsed = time.time() - self.started
+        requests = counters.pop('requests')
+        latency_total = counters.pop('latency_total')
+        counters.update({
+            'requests': requests,
+            'pending': self.queue.qsize(),
+            'docs_per_sec': counters['docs'] / elapsed if elapsed else 0.0,
+            'bytes_per_sec': counters['bytes'] / elapsed if elapsed else 0.0,
+            'latency_mean': latency_total / requests if requests else 0.0,
+        })
+        return counters
+
+    def _work(self):
+        while True:
+            body = self.queue.get()
+            try:
+                if body is None:
+                    return
+                self._send(body)
+            except Exception as exc: # keep the worker alive
+                self.errors.append(repr(exc))
+                with self.lock:
+                    self.counters['failed_docs'] += body.count('\n') // 2
+            finally:
+                self.queue.task_done()
+
+    def _send(self, body):
+        backoff = self.initial_backoff
+        for attempt in range(self.max_retries + 1):
+            lines = body.splitlines()
+            rejected, failed = [], []
+            start = time.time()
+            try:
+                response = self.es_conn.bulk(body=body)
+            except elasticsearch.TransportError as exc:
+                if getattr(exc, 'status_code', None) != 429 or \
+                        attempt == self.max_retries:
+                    raise
+                # the whole request was rejected
+                rejected = list(range(len(lines) // 2))
+            else:
+                for i, item in enumerate(response['items']):
+                    status = item['index'].get('status', 500)
+                    if status == 429:
+                        rejected.append(i)
+                    elif not 200 <= status < 300:
+                        failed.append(item['index'])
+            latency = time.time() - start
+            metrics.observe('es_bulk', latency,
+                            len(lines) // 2 - len(rejected) - len(failed))
+
+            with self.lock:
+                self.counters['requests'] += 1
+                self.counters['bytes'] += len(body)
+                self.counters['docs'] += (
+                    len(lines) // 2 - len(rejected) - len(failed)
+                )
+                self.counters['failed_docs'] += len(failed)
+                self.counters['latency_total'] += latency
+                self.counters['latency_max'] = max(
+                    self.counters['latency_max'], latency
+                )
+            self.errors.extend(failed)
+
+            if not rejected:
+                return
+            if attempt == self.max_retries:
+                with self.lock:
+                    self.counters['failed_docs'] += len(rejected)
+                return
+
+            # Retry only the rejected documents
+            body = ''.join(
+                '%s\n%s\n' % (lines[2*i], lines[2*i+1]) for i in rejected
+            )
+            with self.lock:
+                self.counters['retries'] += 1
+            time.sleep(backoff)
+            backoff = min(2 * backoff, self.max_backoff)
 
 
 def elasticsearch_batch_restreamer(dataframe, timefield, es_conn, index_name,
-                                   interval=10, first_pass=True):
+                                   interval=10, first_pass=True,
+                                   entry_type='measurement', realtime=True):
     """
     Replay input stream into Elasticsearch
     """
-    end_time = np.min(dataframe[timefield])
-    while end_time < np.max(dataframe[timefield]):
-        start_time = end_time
-        end_time += interval*1000
-        if not first_pass:
-            while np.round(time.time()) < end_time/1000.:
-                sys.stdout.write('.')
-                sys.stdout.flush()
-                time.sleep(1)
-
-        ind = np.logical_and(dataframe[timefield] <= end_time,
-                             dataframe[timefield] > start_time)
-        print('\nWriting {} rows dated {} to {}'
-              .format(np.sum(ind),
+    for start_time, end_time, rows in replay_windows(dataframe[timefield],
+                                                     interval*1000):
+        if realtime and not first_pass:
+            wait_until(end_time)
+
+        window = dataframe.iloc[rows]
+        print('Writing {} rows dated {} to {}'
+              .format(window.shape[0],
                       datetime.datetime.fromtimestamp(start_time/1000.),
                       datetime.datetime.fromtimestamp(end_time/1000.)))
 
-        index_properties = {"time" : {"type": "date"}}
-        upload_dataframe(dataframe.loc[ind], index_name, es_conn,
-                         index_properties, recreate=first_pass)
+        upload_dataframe(es_conn, window, index_name, entry_type,
+                         recreate=first_pass)
         first_pass = False
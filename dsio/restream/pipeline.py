@@ -0,0 +1,235 @@
+"""
+Asynchronous restream pipeline
+
+Scores a stream of dataframe batches and replays it to Elasticsearch and/or
+the Bokeh dashboards in stages that run as tasks on one asyncio event loop,
+the same one the Bokeh server runs on:
+
+    source -> score -> replay -> Elasticsearch sink
+                               -> Bokeh sink
+
+The stages are connected by bounded queues, so a stage that falls behind
+makes the ones feeding it wait rather than letting batches pile up in
+memory, e.g. a slow Elasticsearch cluster holds back scoring and reading.
+Reading, scoring and uploading block, so they run in executor threads and
+the event loop stays free to serve the dashboards. None marks the end of
+the stream on every queue.
+
+The source turns the dataframes it reads into struct-of-arrays batches
+(see dsio.batch), optionally float32, and the later stages pass views of
+them along, so the only dataframes built after that are the ones uploaded
+to Elasticsearch.
+
+If any stage fails or the pipeline is cancelled, the remaining stages are
+cancelled too, and each one releases what it holds (the detector models,
+the Elasticsearch writer) on the way out.
+"""
+
+import asyncio
+import datetime
+import functools
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .scheduler import replay_windows, sleep_until
+from ..batch import Batch
+from ..helpers import BatchScorer, skip_seen_rows
+from .. import metrics
+
+MAX_PENDING = 4
+
+
+async def put(queue, item, name):
+    """ Put item on a bounded queue, waiting while it's full """
+    await queue.put(item)
+    metrics.gauge('queue_depth', queue.qsize(), queue=name)
+
+
+def read_batch(dataframes, sensors, timefield, dtype):
+    """ The next dataframe of an iterator as a Batch, or None at the end """
+    dataframe = next(dataframes, None)
+    if dataframe is None:
+        return None
+    return Batch.from_dataframe(dataframe, sensors, timefield, dtype)
+
+
+async def source_stage(dataframes, outbox, sensors, timefield, executor,
+                       dtype=np.float64):
+    """ Read dataframes as batches, in an executor thread since the
+        iterable may block on I/O (a chunked CSV file, a live source) """
+    loop = asyncio.get_running_loop()
+    dataframes = iter(dataframes)
+    while True:
+        with metrics.timed('read') as timer:
+            batch = await loop.run_in_executor(
+                executor, read_batch, dataframes, sensors, timefield, dtype
+            )
+            if batch is not None:
+                timer.rows = len(batch)
+        await put(outbox, batch, 'batches')
+        if batch is None:
+            return
+
+
+async def score_stage(inbox, outbox, sensors, detector, executor, n_jobs=1,
+                      checkpoint=None, checkpoint_interval=60.0,
+                      resume=False):
+    """ Score batches as score_batches does, in an executor thread
+
+        The models are only ever touched from the single thread of the
+        executor, so the update with a batch runs while it's being replayed.
+    """
+    loop = asyncio.get_running_loop()
+    run = functools.partial(loop.run_in_executor, executor)
+
+    batch = await inbox.get()
+    if batch is None:
+        await put(outbox, None, 'scored')
+        return
+    scorer = await run(functools.partial(
+        BatchScorer, sensors, detector, batch.values, n_jobs, checkpoint,
+        checkpoint_interval, resume
+    ))
+    try:
+        while batch is not None:
+            # float32 batches are widened once, for both score and update
+            values = await run(scorer.as_values, batch.values)
+            scores, flags = await run(scorer.score, values)
+            await put(outbox, batch.scored(scores, flags), 'scored')
+            await run(scorer.update, values)
+            batch = await inbox.get()
+
+        await run(scorer.finish)
+        await put(outbox, None, 'scored')
+    finally: # queued behind any work still running on the models
+        await run(scorer.close)
+
+
+async def replay_stage(inbox, sinks, interval=3, realtime=True):
+    """ Split scored batches into windows of interval seconds and pass each
+        one to every sink when it's due, or straight away if realtime is
+        False. Sinks get (window, recreate), where window is a Batch of
+        views and recreate is set for the windows of the first batch """
+    first_pass = True
+    while True:
+        batch = await inbox.get()
+        if batch is None:
+            break
+
+        recreate_index = first_pass
+        for start_time, end_time, rows in replay_windows(batch.time,
+                                                         interval*1000):
+            if realtime and not recreate_index:
+                with metrics.timed('replay_wait'):
+                    await sleep_until(end_time)
+
+            window = batch[rows]
+            print('Writing {} rows dated {} to {}'
+                    .format(len(window),
+                            datetime.datetime.fromtimestamp(start_time/1000.),
+                            datetime.datetime.fromtimestamp(end_time/1000.)))
+
+            for name, sink in sinks.items():
+                await put(sink, (window, recreate_index), name)
+            recreate_index = False
+            metrics.event_lag('restream', end_time)
+
+        first_pass = False
+
+    for name, sink in sinks.items():
+        await put(sink, None, name)
+
+
+async def elasticsearch_stage(inbox, es_writer, executor):
+    """ Upload windows with a BulkWriter, whose write blocks while its
+        workers are backed up, so it runs in an executor thread along with
+        building the dataframe it serializes """
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            item = await inbox.get()
+            if item is None:
+                return
+            window, recreate = item
+            with metrics.timed('es_write', len(window)):
+                await loop.run_in_executor(executor, lambda: es_writer.write(
+                    window.to_dataframe(), recreate=recreate
+                ))
+    finally:
+        await loop.run_in_executor(executor, es_writer.close)
+        print('\nElasticsearch writer stats: {}'.format(es_writer.stats()))
+
+
+async def broadcast_stage(inbox, broadcast):
+    """ Publish windows to the dashboards, which never blocks """
+    while True:
+        item = await inbox.get()
+        if item is None:
+            return
+        broadcast.publish(item[0].columns())
+
+
+async def run_stages(stages):
+    """ Run coroutines as tasks until they all return, cancelling the rest
+        as soon as one of them fails or this is cancelled """
+    tasks = [asyncio.ensure_future(stage) for stage in stages]
+    try:
+        # unlike gather, wait leaves cancelling the tasks to the finally
+        # clause, so each one is cancelled once and can clean up
+        done, _ = await asyncio.wait(tasks,
+                                     return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    for task in done:
+        task.result() # raise the failure, if any
+
+
+async def restream(batches, sensors, detector, timefield, es_writer=None,
+                   broadcast=None, interval=3, realtime=True, n_jobs=1,
+                   checkpoint=None, checkpoint_interval=60.0, resume=False,
+                   max_pending=MAX_PENDING, dtype=np.float64,
+                   skip_seen=True):
+    """ Score an iterable of dataframe batches and restream them, in windows
+        of interval seconds, to es_writer (a BulkWriter) and/or broadcast
+
+        At most max_pending items wait between any two stages. The values of
+        the sensors and their scores are kept as dtype from the source on.
+        The models are trained, checkpointed and resumed as in
+        score_batches, which skip_seen is passed on to.
+    """
+    sensors = list(sensors) # one order for every stage
+    if resume and skip_seen: # read lazily, by the source stage
+        batches = skip_seen_rows(batches, checkpoint)
+    source_executor = ThreadPoolExecutor(1, thread_name_prefix='dsio-source')
+    score_executor = ThreadPoolExecutor(1, thread_name_prefix='dsio-score')
+    sink_executor = ThreadPoolExecutor(1, thread_name_prefix='dsio-sink')
+
+    batch_queue = asyncio.Queue(max_pending)
+    scored_queue = asyncio.Queue(max_pending)
+    sinks, sink_stages = {}, []
+    if es_writer:
+        sinks['elasticsearch'] = asyncio.Queue(max_pending)
+        sink_stages.append(elasticsearch_stage(sinks['elasticsearch'],
+                                               es_writer, sink_executor))
+    if broadcast:
+        sinks['dashboard'] = asyncio.Queue(max_pending)
+        sink_stages.append(broadcast_stage(sinks['dashboard'], broadcast))
+
+    try:
+        await run_stages([
+            source_stage(batches, batch_queue, sensors, timefield,
+                         source_executor, dtype),
+            score_stage(batch_queue, scored_queue, sensors, detector,
+                        score_executor, n_jobs, checkpoint,
+                        checkpoint_interval, resume),
+            replay_stage(scored_queue, sinks, interval, realtime),
+        ] + sink_stages)
+    finally:
+        # a live source may still be waiting for data, don't hang on it
+        source_executor.shutdown(wait=False, cancel_futures=True)
+        score_executor.shutdown(wait=False)
+        sink_executor.shutdown(wait=False)
@@ -0,0 +1,51 @@
+"""
+Replay scheduler
+
+Splits a batch into consecutive windows of time up front, and sleeps until
+each window is due instead of polling the clock.
+"""
+import asyncio
+import time
+
+import numpy as np
+
+
+def replay_windows(timestamps, interval):
+    """ Yield (start_time, end_time, rows) for consecutive windows of
+        interval milliseconds over the timestamps, where rows selects the
+        positions that fall in [start_time, end_time).
+
+        The window boundaries are located with a single searchsorted call,
+        so the cost is linear in the number of rows. If the timestamps are
+        sorted, rows is a slice; otherwise they're put in order with a
+        stable argsort and rows is an array of positions in time order, so
+        that no row is left out of the replay.
+    """
+    timestamps = np.asarray(timestamps)
+    if not len(timestamps):
+        return
+    order = None
+    if np.any(timestamps[1:] < timestamps[:-1]):
+        order = np.argsort(timestamps, kind='stable')
+        timestamps = timestamps[order]
+    first = timestamps[0]
+    n_windows = int((timestamps[-1] - first) // interval) + 1
+    edges = first + interval * np.arange(n_windows + 1)
+    positions = np.searchsorted(timestamps, edges, side='left')
+    for i in range(n_windows):
+        rows = slice(positions[i], positions[i+1])
+        yield edges[i], edges[i+1], rows if order is None else order[rows]
+
+
+def wait_until(deadline):
+    """ Sleep until the deadline, given in unix milliseconds """
+    delay = deadline/1000. - time.time()
+    if delay > 0:
+        time.sleep(delay)
+
+
+async def sleep_until(deadline):
+    """ Like wait_until, without blocking the event loop """
+    delay = deadline/1000. - time.time()
+    if delay > 0:
+        await asyncio.sleep(delay)
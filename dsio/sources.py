@@ -0,0 +1,166 @@
+"""
+Live input sources
+
+Reads newline delimited CSV or JSON records from stdin, a TCP or Unix socket,
+or a file that is still being written to, and groups them into micro-batches
+of pandas dataframes as they arrive. The batches can be passed straight to
+restream_dataframe in place of a dataframe.
+
+Sources are addressed by URI:
+
+    -                        stdin
+    tcp://host:port          connect to a TCP socket
+    unix:///path/to/socket   connect to a Unix domain socket
+    path/to/file.csv         tail a file (when follow=True)
+"""
+
+import io
+import json
+import socket
+import sys
+import threading
+import time
+
+from queue import Queue, Empty
+
+import pandas as pd
+
+from .exceptions import InputSourceError
+
+LIVE_SCHEMES = ('tcp://', 'unix://')
+JSON_EXTENSIONS = ('.json', '.jsonl', '.ndjson')
+
+
+def is_live_source(uri):
+    """ Whether uri points to stdin or a socket rather than a file """
+    return uri == '-' or uri.startswith(LIVE_SCHEMES)
+
+
+def socket_lines(address, family=socket.AF_INET):
+    """ Connect to a socket and return a file object over the lines it
+        receives until it closes """
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        sock.connect(address)
+    except OSError as exc:
+        sock.close()
+        raise InputSourceError('Failed to connect to %r' % (address,), exc)
+
+    return sock.makefile('r')
+
+
+def tail_lines(path, poll_interval=0.5):
+    """ Yield the lines of a file from the start, then wait for new ones
+        as they are appended (like tail -f) """
+    with open(path) as stream:
+        partial = ''
+        while True:
+            line = stream.readline()
+            if not line:
+                time.sleep(poll_interval)
+                continue
+            if not line.endswith('\n'): # the writer is mid-line
+                partial += line
+                continue
+            yield partial + line
+            partial = ''
+
+
+def parse_json_lines(lines):
+    """ Parse a list of JSON encoded records into a dataframe """
+    return pd.DataFrame.from_records([json.loads(line) for line in lines])
+
+
+def csv_lines_parser(sep=','):
+    """ Returns a function that parses lists of CSV lines into dataframes.
+        The first line it's given is treated as the header of the stream. """
+    header = []
+
+    def parse(lines):
+        if not header:
+            header.append(lines[0])
+            lines = lines[1:]
+        return pd.read_csv(io.StringIO('\n'.join(header + lines)), sep=sep)
+
+    return parse
+
+
+def micro_batches(lines, parse, batch_size=1000, max_wait=1.0):
+    """ Group lines into dataframes as they arrive
+
+        A batch is emitted once it has batch_size rows, or max_wait seconds
+        after its first row arrived, whichever comes first. Lines are read
+        from a background thread so a slow source never delays a batch that
+        is due.
+    """
+    queue = Queue(maxsize=batch_size)
+    done = object()
+
+    def read():
+        try:
+            for line in lines:
+                line = line.strip()
+                if line:
+                    queue.put(line)
+        except Exception as exc:
+            queue.put(InputSourceError(exc))
+        queue.put(done)
+
+    threading.Thread(target=read, daemon=True).start()
+
+    finished = False
+    while not finished:
+        batch = []
+        deadline = None
+        while len(batch) < batch_size:
+            timeout = None if deadline is None else max(deadline - time.time(), 0)
+            try:
+                line = queue.get(timeout=timeout)
+            except Empty:
+                break
+            if line is done:
+                finished = True
+                break
+            if isinstance(line, InputSourceError):
+                raise line
+            if deadline is None:
+                deadline = time.time() + max_wait
+            batch.append(line)
+
+        if batch:
+            dataframe = parse(batch)
+            if dataframe.shape[0]:
+                yield dataframe
+
+
+def open_source(uri, fmt=None, batch_size=1000, max_wait=1.0, follow=False,
+                sep=','):
+    """ Open the input source at uri and return an iterator over its
+        micro-batches
+
+        fmt is either 'csv' or 'json' (newline delimited). If it's not given
+        it's inferred from the file extension, defaulting to csv.
+    """
+    if uri == '-':
+        lines = sys.stdin
+    elif uri.startswith('tcp://'):
+        host, port = uri[len('tcp://'):].rsplit(':', 1)
+        lines = socket_lines((host, int(port)), socket.AF_INET)
+    elif uri.startswith('unix://'):
+        lines = socket_lines(uri[len('unix://'):], socket.AF_UNIX)
+    elif follow:
+        lines = tail_lines(uri)
+    else:
+        raise InputSourceError('%s is not a live source' % uri)
+
+    if fmt is None:
+        fmt = 'json' if uri.endswith(JSON_EXTENSIONS) else 'csv'
+
+    if fmt == 'json':
+        parse = parse_json_lines
+    elif fmt == 'csv':
+        parse = csv_lines_parser(sep)
+    else:
+        raise InputSourceError('Unknown input format %s' % fmt)
+
+    return micro_batches(lines, parse, batch_size=batch_size, max_wait=max_wait)
@@ -11,6 +11,8 @@ It also hosts certain decision formulae.
 
 import numpy as np
 
+from scipy.special import ndtr
+
 
 def convex_combination(a, b, weight):
     """
@@ -34,25 +36,152 @@ def update_effective_sample_size(
 ):
     """
 
-    :param effective_sample_size:
-    :param batch_size:
-    :param forgetting_factor:
-    :return:
+    :param effective_sample_size: the (discounted) number of datapoints seen so far
+    :param batch_size: the number of new datapoints
+    :param forgetting_factor: the discount applied to the old datapoints (1.0 means no forgetting)
+    :return: the updated effective sample size, and the weight of the new batch in it
 
     >>> update_effective_sample_size(1.0,1.0,1.0)
-    (2.0, 1.0)
+    (2.0, 0.5)
+    >>> update_effective_sample_size(3.0,1.0,1.0)
+    (4.0, 0.25)
 
     """
     updated_sample_size = (
         effective_sample_size * forgetting_factor + batch_size
     )
-    weight = 1 - (
-        (effective_sample_size*1.0 - batch_size) /
-        (effective_sample_size*1.0)
-    )
+    weight = batch_size / (updated_sample_size*1.0)
     return updated_sample_size, weight
 
 
+def update_mean_variance(
+    mean,
+    variance,
+    effective_sample_size,
+    x,
+    forgetting_factor=1.0
+):
+    """
+
+    :param mean: the running mean, a scalar or one value per column of x
+    :param variance: the running (population) variance, same shape as mean
+    :param effective_sample_size: the (discounted) number of datapoints behind mean and variance, a scalar or one value per column of x
+    :param x: the new datapoints, shape (n_samples, ) or (n_samples, n_columns)
+    :param forgetting_factor: the discount applied to the old datapoints (1.0 means no forgetting)
+    :return: the updated mean, variance and effective sample size
+
+    Merges the summary of the new batch into the running one (Chan et al.),
+    which is numerically stable and only keeps O(1) state per column.
+    A single datapoint is a batch of size one.
+
+    Missing values (NaN) are skipped, so each column is updated with the
+    datapoints it has and the effective sample size becomes per column.
+    A column with no history yet (an effective sample size of 0, or a
+    mean or variance that isn't finite) takes the summary of the batch as
+    it is, and stays NaN until a batch has datapoints for it.
+
+    >>> mean, variance, ess = update_mean_variance(2.0, 1.0, 2, [2.0, 4.0])
+    >>> float(mean), float(variance), ess
+    (2.5, 1.25, 4.0)
+    >>> mean, variance, ess = update_mean_variance(
+    ...     np.array([2.0, 2.0]), np.ones(2), 2, [[2.0, np.nan], [4.0, 3.0]])
+    >>> mean.tolist(), variance.tolist(), ess.tolist()
+    ([2.5, 2.3333333333333335], [1.25, 0.888888888888889], [4.0, 3.0])
+    >>> mean, variance, ess = update_mean_variance(
+    ...     np.array([2.0, np.nan]), np.array([1.0, np.nan]), np.array([2, 0]),
+    ...     [[2.0, 5.0], [4.0, 3.0]])
+    >>> mean.tolist(), variance.tolist(), ess.tolist()
+    ([2.5, 4.0], [1.25, 1.0], [4.0, 2.0])
+
+    """
+    x = np.asarray(x, dtype=float)
+    no_history = (
+        (np.asarray(effective_sample_size) == 0) |
+        ~np.isfinite(mean) | ~np.isfinite(variance)
+    )
+    valid = ~np.isnan(x)
+    if valid.all():
+        batch_size = len(x)
+        batch_mean = np.mean(x, axis=0)
+        batch_variance = np.var(x, axis=0)
+    else:
+        batch_size = np.count_nonzero(valid, axis=0)
+        # columns without datapoints get a weight of zero, so any finite
+        # batch summary leaves them as they were
+        n_valid = np.maximum(batch_size, 1)
+        batch_mean = np.where(valid, x, 0.0).sum(axis=0) / n_valid
+        batch_variance = (
+            np.where(valid, x - batch_mean, 0.0)**2
+        ).sum(axis=0) / n_valid
+    # the weight is 0/0 for columns without datapoints so far, which are
+    # among the ones set from the batch below
+    with np.errstate(invalid='ignore'):
+        updated_sample_size, weight = update_effective_sample_size(
+            effective_sample_size=effective_sample_size,
+            batch_size=batch_size,
+            forgetting_factor=forgetting_factor
+        )
+        delta = batch_mean - mean
+        variance = (
+            convex_combination(variance, batch_variance, weight=weight) +
+            weight * (1 - weight) * delta**2
+        )
+        mean = convex_combination(mean, batch_mean, weight=weight)
+    if np.any(no_history):
+        has_batch = np.asarray(batch_size) > 0
+        mean = np.where(no_history, np.where(has_batch, batch_mean, np.nan),
+                        mean)
+        variance = np.where(no_history,
+                            np.where(has_batch, batch_variance, np.nan),
+                            variance)
+        updated_sample_size = np.where(no_history, batch_size,
+                                       updated_sample_size)
+    return mean, variance, updated_sample_size
+
+
+def update_mean_covariance(
+    mean,
+    covariance,
+    effective_sample_size,
+    x,
+    forgetting_factor=1.0
+):
+    """
+
+    :param mean: the running mean, one value per column of x
+    :param covariance: the running (population) covariance matrix of the columns of x
+    :param effective_sample_size: the (discounted) number of datapoints behind mean and covariance
+    :param x: the new datapoints, shape (n_samples, n_columns)
+    :param forgetting_factor: the discount applied to the old datapoints (1.0 means no forgetting)
+    :return: the updated mean, covariance and effective sample size
+
+    The multivariate version of update_mean_variance: the batch enters as a
+    rank-k update of the covariance, plus a rank-1 correction for the shift
+    of the mean.
+
+    >>> mean, covariance, ess = update_mean_covariance(
+    ...     np.zeros(2), np.eye(2), 2, [[2.0, 2.0], [2.0, 2.0]])
+    >>> mean.tolist(), covariance.tolist(), ess
+    ([1.0, 1.0], [[1.5, 1.0], [1.0, 1.5]], 4.0)
+
+    """
+    x = np.asarray(x, dtype=float)
+    effective_sample_size, weight = update_effective_sample_size(
+        effective_sample_size=effective_sample_size,
+        batch_size=len(x),
+        forgetting_factor=forgetting_factor
+    )
+    batch_mean = np.mean(x, axis=0)
+    centred = x - batch_mean
+    delta = batch_mean - mean
+    covariance = (
+        convex_combination(covariance, centred.T @ centred / len(x), weight=weight) +
+        weight * (1 - weight) * np.outer(delta, delta)
+    )
+    mean = convex_combination(mean, batch_mean, weight=weight)
+    return mean, covariance, effective_sample_size
+
+
 def rolling_window_update(old, new, w=100):
     """
 
@@ -62,7 +191,7 @@ def rolling_window_update(old, new, w=100):
     :return: The w most recent datapoints from the concatenation of old and new
 
     >>> rolling_window_update(old=[1,2,3], new=[4,5,6,7],w=5)
-    array([3,4,5,6,7])
+    array([3, 4, 5, 6, 7])
 
     """
     out = np.concatenate((old, new))
@@ -71,6 +200,197 @@ def rolling_window_update(old, new, w=100):
     return out
 
 
+class RollingWindow(object):
+    """
+    The latest size datapoints of a stream, in a preallocated ring buffer
+
+    Unlike rolling_window_update, appending a batch only copies the batch
+    in, over the oldest datapoints, instead of reallocating the whole
+    window. The window holds one column per sensor if n_columns is given.
+
+    >>> window = RollingWindow(4)
+    >>> window.append([1., 2., 3.])
+    array([], dtype=float64)
+    >>> window.append([4., 5., 6.])
+    array([1., 2.])
+    >>> np.asarray(window)
+    array([3., 4., 5., 6.])
+    >>> [view.tolist() for view in window.views()]
+    [[3.0, 4.0], [5.0, 6.0]]
+
+    """
+
+    def __init__(self, size, n_columns=None, dtype=float):
+        shape = (size,) if n_columns is None else (size, n_columns)
+        self.buffer = np.empty(shape, dtype=dtype)
+        self.size = size
+        self.start = 0
+        self.count = 0
+
+    @classmethod
+    def from_array(cls, values, size):
+        """ A window holding the last size rows of values """
+        values = np.asarray(values)
+        window = cls(size, values.shape[1] if values.ndim > 1 else None,
+                     values.dtype)
+        window.append(values)
+        return window
+
+    def __len__(self):
+        return self.count
+
+    def views(self):
+        """ The window in arrival order, as one or two views of the buffer
+            that are only valid until the next append """
+        end = self.start + self.count
+        if end <= self.size:
+            return (self.buffer[self.start:end],)
+        return (self.buffer[self.start:], self.buffer[:end - self.size])
+
+    def __array__(self, dtype=None, copy=None):
+        """ A copy of the window in arrival order """
+        out = np.concatenate(self.views())
+        return out if dtype is None else out.astype(dtype, copy=False)
+
+    def oldest(self, n):
+        """ A copy of the n oldest datapoints """
+        return self.buffer[(self.start + np.arange(n)) % self.size]
+
+    def append(self, x):
+        """ Add a batch of datapoints, returning a copy of the ones it
+            evicts from the window, oldest first """
+        x = np.asarray(x, dtype=self.buffer.dtype)
+        n_evicted = min(max(self.count + len(x) - self.size, 0), self.count)
+        evicted = self.oldest(n_evicted)
+        if len(x) >= self.size:
+            self.buffer[:] = x[len(x) - self.size:]
+            self.start, self.count = 0, self.size
+            return evicted
+
+        end = (self.start + self.count) % self.size
+        first = min(len(x), self.size - end)
+        self.buffer[end:end + first] = x[:first]
+        self.buffer[:len(x) - first] = x[first:]
+        self.start = (self.start + n_evicted) % self.size
+        self.count = min(self.count + len(x), self.size)
+        return evicted
+
+
+def sorted_window_edit(sorted_old, evicted, new):
+    """
+
+    :param sorted_old: The current window, in ascending order
+    :param evicted: The datapoints leaving the window (each must be present in sorted_old)
+    :param new: The datapoints entering the window
+    :return: The positions in sorted_old to delete, and the positions to insert
+        the sorted new datapoints at once they are deleted, in the form taken
+        by np.delete and np.insert, along with the sorted new datapoints
+
+    Lets arrays that are aligned with the window follow the same edit.
+
+    >>> sorted_window_edit(np.array([1., 2., 2., 5.]), [2., 1.], [3., 0.])
+    (array([0, 1]), array([0, 1]), array([0., 3.]))
+
+    """
+    evicted = np.sort(evicted)
+    # equal values map to consecutive positions of their run in sorted_old
+    delete_index = np.searchsorted(sorted_old, evicted, side='left')
+    delete_index += np.arange(len(evicted)) - np.searchsorted(evicted, evicted, side='left')
+    out = np.delete(sorted_old, delete_index)
+    new = np.sort(new)
+    return delete_index, np.searchsorted(out, new), new
+
+
+def sorted_window_update(sorted_old, evicted, new):
+    """
+
+    :param sorted_old: The current window, in ascending order, or a window per column sorted independently
+    :param evicted: The datapoints leaving the window (each must be present in sorted_old)
+    :param new: The datapoints entering the window
+    :return: The updated window, in ascending order
+
+    Costs O(w + b log w) rather than the O(w log w) of sorting the whole
+    window again, for a window of size w and a batch of size b. The columns
+    of a 2-D window are located one by one but edited all at once.
+
+    >>> sorted_window_update(np.array([1., 2., 2., 5.]), [2., 1.], [3., 0.])
+    array([0., 2., 3., 5.])
+    >>> sorted_window_update(np.array([[1., 4.], [2., 6.]]), [[1., 6.]], [[3., 5.]])
+    array([[2., 4.],
+           [3., 5.]])
+
+    """
+    if np.ndim(sorted_old) == 1:
+        delete_index, insert_index, new = sorted_window_edit(sorted_old, evicted, new)
+        return np.insert(np.delete(sorted_old, delete_index), insert_index, new)
+
+    evicted = np.sort(evicted, axis=0)
+    new = np.sort(new, axis=0)
+    n_columns = sorted_old.shape[1]
+    delete_index = np.empty(evicted.shape, dtype=np.intp)
+    insert_index = np.empty(new.shape, dtype=np.intp)
+    for i in range(n_columns):
+        # as in sorted_window_edit, but the insert positions are found in
+        # sorted_old, discounting the evicted datapoints that precede them
+        delete_index[:, i] = (np.searchsorted(sorted_old[:, i], evicted[:, i]) -
+                              np.searchsorted(evicted[:, i], evicted[:, i]))
+        insert_index[:, i] = (np.searchsorted(sorted_old[:, i], new[:, i]) -
+                              np.searchsorted(evicted[:, i], new[:, i]))
+    delete_index += np.arange(len(evicted))[:, None]
+    insert_index += np.arange(len(new))[:, None] # positions in the output
+
+    columns = np.arange(n_columns)
+    kept = np.ones(sorted_old.shape, dtype=bool)
+    kept[delete_index, columns] = False
+    inserted = np.zeros((len(sorted_old) - len(evicted) + len(new), n_columns),
+                        dtype=bool)
+    inserted[insert_index, columns] = True
+    # through the transposes, boolean indexing goes column by column
+    out = np.empty(inserted.shape)
+    out.T[inserted.T] = new.T.ravel()
+    out.T[~inserted.T] = sorted_old.T[kept.T]
+    return out
+
+
+def percentile_rank(sorted_sample, x):
+    """
+
+    :param sorted_sample: The reference sample, in ascending order, or a sample per column sorted independently
+    :param x: The datapoints to rank against the sample, with the same number of columns
+    :return: The percentile rank of each datapoint, between 0 and 1
+
+    Equivalent to 0.01*scipy.stats.percentileofscore(sample, z, kind='rank')
+    for every z in x, in O(len(x) log len(sample)). Missing values (NaN) in
+    the sample are sorted last and left out, so each column is ranked
+    against the datapoints it has.
+
+    >>> percentile_rank(np.array([1., 2., 3., 3., 4.]), [2., 3.])
+    array([0.4, 0.7])
+    >>> percentile_rank(np.array([[1., 1.], [2., 3.]]), [[2., 2.]])
+    array([[1. , 0.5]])
+    >>> percentile_rank(np.array([[1., 1.], [2., np.nan]]), [[2., 2.]])
+    array([[1., 1.]])
+
+    """
+    x = np.asarray(x, dtype=float)
+    if np.ndim(sorted_sample) == 1:
+        left = np.searchsorted(sorted_sample, x, side='left')
+        right = np.searchsorted(sorted_sample, x, side='right')
+    else: # searchsorted only handles one column at a time
+        left = np.empty(x.shape, dtype=np.intp)
+        right = np.empty(x.shape, dtype=np.intp)
+        for i in range(x.shape[1]):
+            left[:, i] = np.searchsorted(sorted_sample[:, i], x[:, i], side='left')
+            right[:, i] = np.searchsorted(sorted_sample[:, i], x[:, i], side='right')
+    n_valid = len(sorted_sample) - np.count_nonzero(np.isnan(sorted_sample),
+                                                    axis=0)
+    # same arithmetic as scipy, so the results match it bit for bit
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rank = 0.01 * ((left + right + (right > left)) * (50.0 / n_valid))
+    rank[np.isnan(x)] = np.nan
+    return rank
+
+
 def decision_rule(score, threshold=0.99, two_sided=True):
     """
 
@@ -79,13 +399,13 @@ def decision_rule(score, threshold=0.99, two_sided=True):
     :param two_sided: if True, we flag anomalies that are either smaller than 1-threshold or larger than threhsold
     :return: a boolean flag
 
-    >>> decision_rule(score=0.9)
+    >>> print(decision_rule(score=0.9))
     False
-    >>> decision_rule(score=0.95, threshold=0.9)
+    >>> print(decision_rule(score=0.95, threshold=0.9))
     True
-    >>> decision_rule(score=0.0001, threshold=0.99)
+    >>> print(decision_rule(score=0.0001, threshold=0.99))
     True
-    >>> decision_rule(score=0.001, two_sided=False)
+    >>> print(decision_rule(score=0.001, two_sided=False))
     False
     """
     if two_sided:
@@ -93,3 +413,45 @@ def decision_rule(score, threshold=0.99, two_sided=True):
     else:
         ans = score > threshold
     return ans
+
+
+def gaussian_score_and_flag(x, mu, std, threshold=0.99, two_sided=True,
+                            scores=None, flags=None):
+    """
+
+    :param x: the datapoints, shape (n_samples, ) or (n_samples, n_columns)
+    :param mu: the mean, a scalar or one value per column of x
+    :param std: the standard deviation, same shape as mu
+    :param threshold: as in decision_rule
+    :param two_sided: as in decision_rule
+    :param scores: optional float array shaped like x to write the scores to
+    :param flags: optional boolean array shaped like x to write the flags to
+    :return: the scores ndtr(|x - mu|/std) and their decision_rule flags
+
+    Equivalent to decision_rule(ndtr(np.abs(x - mu)/std), ...), but the
+    ufuncs work in place on the scores, so the outputs are the only arrays
+    allocated (or none, if they are passed in).
+
+    >>> scores, flags = gaussian_score_and_flag(np.array([0., 3.]), 0., 1.)
+    >>> scores.round(4).tolist(), flags.tolist()
+    ([0.5, 0.9987], [False, True])
+
+    """
+    x = np.asarray(x)
+    if x.dtype.kind != 'f':
+        x = x.astype(float)
+    if scores is None:
+        scores = np.empty(x.shape)
+    if flags is None:
+        flags = np.empty(x.shape, dtype=bool)
+
+    np.subtract(x, mu, out=scores)
+    np.abs(scores, out=scores)
+    np.divide(scores, std, out=scores)
+    ndtr(scores, out=scores)
+    np.greater(scores, threshold, out=flags)
+    # the scores are at least 0.5, so they can only fall below 1-threshold
+    # if the threshold is below 0.5
+    if two_sided and threshold < 0.5:
+        flags |= scores < 1 - threshold
+    return scores, flags
@@ -1,4 +1,4 @@
-from dsio.anomaly_detectors import Gaussian1D, Percentile1D, compute_confusion_matrix
+from dsio.anomaly_detectors import Gaussian1D, Percentile1D, LOF1D, compute_confusion_matrix
 from dsio.generate_data import gen_data_with_obvious_anomalies
 from examples.lof_anomaly_detector import LOFAnomalyDetector
 
@@ -30,3 +30,11 @@ print(compute_confusion_matrix(detector_output3, index_anomalies))
 detector3.fit(x[101:])
 detector_output3 = detector3.flag_anomaly(x)
 print(compute_confusion_matrix(detector_output3, index_anomalies))
+
+detector4 = LOF1D()
+detector4.fit(x[:50])
+detector_output4 = detector4.flag_anomaly(x)
+print(compute_confusion_matrix(detector_output4, index_anomalies))
+detector4.update(x[101:])
+detector_output4 = detector4.flag_anomaly(x)
+print(compute_confusion_matrix(detector_output4, index_anomalies))
@@ -2,6 +2,10 @@
 Example of how to embed sklearn objects into our framework by overriding certain methods
 Over-riding parts of the sklearn implementation:
 https://github.com/scikit-learn/scikit-learn/blob/a24c8b464d094d2c468a16ea9f8bf8d42d949f84/sklearn/neighbors/lof.py#L272
+
+Every update refits the LOF on the whole window, for a streaming LOF that
+only recomputes the neighbourhoods an update touches see
+dsio.anomaly_detectors.LOF1D
 """
 
 import numpy as np
@@ -9,7 +13,7 @@ import pandas as pd
 
 from sklearn.neighbors import LocalOutlierFactor
 from dsio.anomaly_detectors import AnomalyMixin
-from dsio.update_formulae import rolling_window_update
+from dsio.update_formulae import RollingWindow
 
 
 class LOFAnomalyDetector(LocalOutlierFactor, AnomalyMixin):
@@ -20,25 +24,26 @@ class LOFAnomalyDetector(LocalOutlierFactor, AnomalyMixin):
     ):
         self.window_size = window_size
         self.sample_ = []
-        super(LOFAnomalyDetector, self).__init__(n_neighbors=n_neighbors)
+        # novelty=True lets the fitted LOF score new datapoints
+        super(LOFAnomalyDetector, self).__init__(n_neighbors=n_neighbors,
+                                                 novelty=True)
 
     def fit(self, x, y=None):  # we add None to agree with sklearn conventions
         x = pd.Series(x)
-        self.__setattr__('sample_ ', x[:int(np.floor(self.window_size))])
-        super(LOFAnomalyDetector, self).fit(x.values.reshape(-1, 1))  # dsio currently only handles 1D data
+        self.__setattr__('sample_', RollingWindow.from_array(
+            x.values[:int(np.floor(self.window_size))],
+            int(np.floor(self.window_size))
+        ))
+        super(LOFAnomalyDetector, self).fit(np.asarray(self.sample_).reshape(-1, 1))  # dsio currently only handles 1D data
 
-    def update(self, x): # this simply refits the LOF for now
+    def update(self, x): # this simply refits the LOF on the window
         x = pd.Series(x)
-        window = rolling_window_update(
-            old=self.sample_, new=x,
-            w=int(np.floor(self.window_size))
-        )
-        self.__setattr__('sample_', window)
-        self.fit(x)
+        self.sample_.append(x.values)
+        super(LOFAnomalyDetector, self).fit(np.asarray(self.sample_).reshape(-1, 1))
 
     def score_anomaly(self, x):
         x = pd.Series(x)
-        scores = (-self._predict(x.values.reshape(-1, 1))+1)/2.0
+        scores = (-self.predict(x.values.reshape(-1, 1))+1)/2.0
         return scores
 
     def flag_anomaly(self, x):
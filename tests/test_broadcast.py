@@ -0,0 +1,96 @@
+""" Broadcast ring buffer against the list of published rows """
+
+import threading
+import unittest
+
+import numpy as np
+
+from dsio.broadcast import Broadcast
+
+
+def rows(start, stop):
+    """ Columns of rows start to stop, numbered by their position in the
+        stream """
+    return {'time': np.arange(start, stop, dtype=np.int64),
+            'value': np.arange(start, stop) * 0.5}
+
+
+class BroadcastTest(unittest.TestCase):
+
+    def assert_rows(self, columns, start, stop):
+        self.assertEqual(list(columns), ['time', 'value'])
+        np.testing.assert_array_equal(columns['time'], np.arange(start, stop))
+        np.testing.assert_array_equal(columns['value'],
+                                      np.arange(start, stop) * 0.5)
+
+    def test_wraparound(self):
+        broadcast = Broadcast(capacity=8)
+        subscriber = broadcast.subscribe()
+        published = 0
+        # batches that end at, and straddle, the end of the buffer
+        for n_rows in [5, 3, 6, 1, 7, 8, 2]:
+            broadcast.publish(rows(published, published + n_rows))
+            self.assert_rows(subscriber.read(), published,
+                             published + n_rows)
+            published += n_rows
+        self.assertEqual(subscriber.dropped, 0)
+        self.assertEqual(subscriber.pending(), 0)
+        self.assert_rows(broadcast.subscribe(from_start=True).read(),
+                         published - 8, published)
+
+    def test_slow_subscriber_counts_dropped_rows(self):
+        broadcast = Broadcast(capacity=8)
+        subscriber = broadcast.subscribe()
+        broadcast.publish(rows(0, 5))
+        broadcast.publish(rows(5, 11))
+        self.assertEqual(subscriber.pending(), 11)
+        # rows 0 to 2 were overwritten before they were read
+        self.assert_rows(subscriber.read(), 3, 11)
+        self.assertEqual(subscriber.dropped, 3)
+
+        broadcast.publish(rows(11, 30))
+        self.assert_rows(subscriber.read(), 22, 30)
+        self.assertEqual(subscriber.dropped, 3 + 11)
+
+    def test_batch_bigger_than_the_buffer(self):
+        broadcast = Broadcast(capacity=8)
+        subscriber = broadcast.subscribe()
+        broadcast.publish(rows(0, 3))
+        broadcast.publish(rows(3, 23))
+        self.assert_rows(subscriber.read(), 15, 23)
+        self.assertEqual(subscriber.dropped, 15)
+        self.assertEqual(broadcast.head, 23)
+
+    def test_read_latest_rows_only(self):
+        broadcast = Broadcast(capacity=8)
+        subscriber = broadcast.subscribe()
+        broadcast.publish(rows(0, 6))
+        self.assert_rows(subscriber.read(max_rows=2), 4, 6)
+        # skipping rows on purpose doesn't count as dropping them
+        self.assertEqual(subscriber.dropped, 0)
+        self.assertEqual(subscriber.read(), {})
+
+    def test_subscribers_read_at_their_own_pace(self):
+        broadcast = Broadcast(capacity=8)
+        fast, slow = broadcast.subscribe(), broadcast.subscribe()
+        for start in range(0, 12, 3):
+            broadcast.publish(rows(start, start + 3))
+            self.assert_rows(fast.read(), start, start + 3)
+        self.assert_rows(slow.read(), 4, 12)
+        self.assertEqual((fast.dropped, slow.dropped), (0, 4))
+        self.assertEqual(list(slow.read_dataframe().columns),
+                         ['time', 'value'])
+
+    def test_wait_for_rows(self):
+        broadcast = Broadcast(capacity=8)
+        subscriber = broadcast.subscribe()
+        self.assertFalse(subscriber.wait(timeout=0.01))
+        timer = threading.Timer(0.05, broadcast.publish, [rows(0, 2)])
+        timer.start()
+        self.assertTrue(subscriber.wait(timeout=5))
+        timer.join()
+        self.assert_rows(subscriber.read(), 0, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+""" Saving detector state and resuming from it """
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from dsio.anomaly_detectors import (
+    Gaussian1D, Percentile1D, PercentileSketch1D, LOF1D, Mahalanobis
+)
+from dsio.checkpoint import save_checkpoint, load_checkpoint
+from dsio.helpers import init_detector_models, score_batches, iter_batches
+
+DETECTORS = [Gaussian1D, Percentile1D, PercentileSketch1D, LOF1D, Mahalanobis]
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'state.npz')
+        rng = np.random.default_rng(0)
+        self.sensors = ['a', 'b', 'c']
+        self.values = rng.normal(size=(400, 3)) * [1., 10., 100.]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_restore_with_the_sensors_in_another_order(self):
+        order = [2, 0, 1]
+        permuted = [self.sensors[i] for i in order]
+        probe = self.values[::7] * 1.5
+        for detector in DETECTORS:
+            model = init_detector_models(self.sensors, self.values[:300],
+                                         detector)
+            model.update(self.values[300:])
+            save_checkpoint(self.path, model, detector, self.sensors, 400)
+
+            state, metadata = load_checkpoint(self.path, detector, permuted)
+            restored = init_detector_models(permuted, self.values, detector,
+                                            state=state)
+            self.assertEqual(metadata['rows'], 400)
+            expected_scores, expected_flags = model.score_and_flag(probe)
+            scores, flags = restored.score_and_flag(probe[:, order])
+            np.testing.assert_allclose(scores, expected_scores[:, order],
+                                       err_msg=detector.__name__)
+            np.testing.assert_array_equal(flags, expected_flags[:, order])
+
+    def stream(self, n_batches=None, **kwargs):
+        dataframe = pd.DataFrame(self.values, columns=self.sensors)
+        batches = list(iter_batches(dataframe, 50))[:n_batches]
+        return [(batch.index[0], scores) for batch, scores, _ in
+                score_batches(batches, self.sensors, Gaussian1D,
+                              checkpoint=self.path, **kwargs)]
+
+    def test_resume_skips_the_rows_seen_before_the_checkpoint(self):
+        uninterrupted = self.stream()
+        uninterrupted_state = load_checkpoint(self.path, Gaussian1D,
+                                              self.sensors)[0]
+
+        self.stream(n_batches=3)
+        resumed = self.stream(resume=True)
+        self.assertEqual([start for start, _ in resumed],
+                         list(range(150, 400, 50)))
+        for (_, scores), (_, expected) in zip(resumed, uninterrupted[3:]):
+            np.testing.assert_allclose(scores, expected)
+
+        state, metadata = load_checkpoint(self.path, Gaussian1D, self.sensors)
+        self.assertEqual(metadata['rows'], 400)
+        for name, value in uninterrupted_state.items():
+            np.testing.assert_allclose(state[name], value)
+
+    def test_resume_without_skipping(self):
+        self.stream(n_batches=3)
+        resumed = self.stream(resume=True, skip_seen=False)
+        self.assertEqual(len(resumed), 8)
+        self.assertEqual(load_checkpoint(self.path, Gaussian1D,
+                                         self.sensors)[1]['rows'], 550)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,237 @@
+""" Incremental detector updates against refitting from scratch """
+
+import unittest
+
+import numpy as np
+
+from dsio.anomaly_detectors import (
+    Gaussian1D, LOF1D, Mahalanobis, Percentile1D, PercentileSketch1D
+)
+
+
+class Gaussian1DMissingValuesTest(unittest.TestCase):
+
+    def test_sensor_missing_from_the_training_set(self):
+        training_set = np.random.default_rng(0).normal(size=(20, 2))
+        training_set[:, 1] = np.nan
+        detector = Gaussian1D()
+        detector.fit(training_set)
+        self.assertEqual(detector.ess_[1], 0)
+
+        detector.update(np.array([[0., 1.], [0., 3.], [0., np.nan]]))
+        np.testing.assert_allclose([detector.mu_[1], detector.std_[1]],
+                                   [2., 1.])
+        self.assertEqual(detector.ess_[1], 2)
+        _, flags = detector.score_and_flag(np.array([[0., 100.]]))
+        self.assertTrue(flags[0, 1])
+
+    def test_fit_skips_missing_values(self):
+        detector = Gaussian1D()
+        detector.fit([1., 2., np.nan, 3., 4.])
+        self.assertEqual(detector.mu_, 2.5)
+        self.assertEqual(detector.ess_, 4)
+        self.assertTrue(detector.flag_anomaly(np.array([100.]))[0])
+
+
+class Percentile1DMissingValuesTest(unittest.TestCase):
+
+    def test_missing_values_in_the_window(self):
+        rng = np.random.default_rng(0)
+        values = rng.normal(size=(500, 2))
+        values[rng.choice(500, 40, replace=False), 0] = np.nan
+        detector = Percentile1D(window_size=300)
+        detector.fit(values[:300])
+        probe = np.array([[100., 100.], [0., 0.], [-1., 1.]])
+        for start in range(300, 500, 25):
+            detector.update(values[start:start + 25])
+            window = np.asarray(detector.sample_)
+            np.testing.assert_array_equal(detector.sorted_sample_,
+                                          np.sort(window, axis=0))
+            for i in range(2):
+                column = window[:, i][~np.isnan(window[:, i])]
+                expected = [(np.sum(column < z) + np.sum(column <= z) +
+                             (np.sum(column == z) > 0)) / (2. * len(column))
+                            for z in probe[:, i]]
+                np.testing.assert_allclose(
+                    detector.score_anomaly(probe)[:, i], expected)
+        self.assertTrue(detector.flag_anomaly(probe)[0].all())
+
+
+class LOF1DUpdateTest(unittest.TestCase):
+
+    def assert_matches_refit(self, detector, probe):
+        refit = LOF1D(n_neighbors=detector.n_neighbors,
+                      window_size=detector.window_size)
+        refit.fit(np.asarray(detector.sample_))
+
+        np.testing.assert_array_equal(detector.sorted_sample_,
+                                      refit.sorted_sample_)
+        np.testing.assert_allclose(detector.kdist_, refit.kdist_)
+        np.testing.assert_allclose(detector.lrd_, refit.lrd_)
+        np.testing.assert_allclose(detector.score_anomaly(probe),
+                                   refit.score_anomaly(probe))
+
+    def stream(self, values, batch_sizes, n_neighbors=5, window_size=50):
+        detector = LOF1D(n_neighbors=n_neighbors, window_size=window_size)
+        detector.fit(values[:window_size])
+        probe = np.linspace(values.min() - 1, values.max() + 1, 37)
+        start = window_size
+        for batch_size in batch_sizes:
+            detector.update(values[start:start + batch_size])
+            start += batch_size
+            self.assert_matches_refit(detector, probe)
+
+    def test_update_matches_refit(self):
+        values = np.random.default_rng(0).normal(size=400)
+        self.stream(values, [1, 3, 5, 6, 17, 30, 49, 1, 2])
+
+    def test_update_with_duplicates(self):
+        # few distinct values, so most points have ties within n_neighbors
+        values = np.random.default_rng(1).integers(0, 8, 400).astype(float)
+        self.stream(values, [1, 2, 6, 11, 25, 1, 40, 3])
+
+    def test_update_with_batches_bigger_than_window(self):
+        values = np.random.default_rng(2).normal(size=400)
+        self.stream(values, [60, 7, 50, 12])
+
+    def test_update_while_window_fills(self):
+        values = np.random.default_rng(3).normal(size=200)
+        detector = LOF1D(n_neighbors=5, window_size=50)
+        detector.fit(values[:4])
+        probe = np.linspace(-3, 3, 13)
+        for start, stop in [(4, 5), (5, 12), (12, 30), (30, 80), (80, 87)]:
+            detector.update(values[start:stop])
+            self.assert_matches_refit(detector, probe)
+
+    def test_missing_values_stay_out_of_the_window(self):
+        values = np.random.default_rng(4).normal(size=200)
+        with_gaps = values.copy()
+        with_gaps[[3, 60, 61, 120]] = [np.nan, np.nan, np.inf, -np.inf]
+        finite = np.isfinite(with_gaps)
+        detector = LOF1D(n_neighbors=5, window_size=50)
+        detector.fit(with_gaps[:55])
+        expected = LOF1D(n_neighbors=5, window_size=50)
+        expected.fit(values[:55][finite[:55]])
+        probe = np.array([-1., 0., 0.5, np.nan])
+        for start in range(55, 200, 15):
+            detector.update(with_gaps[start:start + 15])
+            batch = values[start:start + 15]
+            expected.update(batch[finite[start:start + 15]])
+            np.testing.assert_array_equal(detector.sorted_sample_,
+                                          expected.sorted_sample_)
+            self.assertTrue(np.isfinite(detector.lrd_).all())
+            np.testing.assert_array_equal(detector.score_anomaly(probe),
+                                          expected.score_anomaly(probe))
+        detector.update([np.nan, np.nan])
+        np.testing.assert_array_equal(detector.sorted_sample_,
+                                      expected.sorted_sample_)
+
+
+
+class MahalanobisUpdateTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(5)
+        mixing = np.array([[1., 0., 0.], [.8, .6, 0.], [-.5, .2, 2.]])
+        self.values = rng.normal(size=(500, 3)) @ mixing.T + [1., -2., 10.]
+        self.splits = [200, 201, 260, 400]
+
+    def recompute(self, weights):
+        """ Weighted mean and population covariance of all the rows """
+        mean = np.average(self.values, axis=0, weights=weights)
+        centred = self.values - mean
+        covariance = (weights[:, None] * centred).T @ centred / weights.sum()
+        return mean, covariance, weights.sum()
+
+    def stream(self, ff):
+        detector = Mahalanobis(ff=ff)
+        batches = np.split(self.values, self.splits)
+        detector.fit(batches[0])
+        for batch in batches[1:]:
+            detector.update(batch)
+        return detector
+
+    def assert_state(self, detector, mean, covariance, ess):
+        np.testing.assert_allclose(detector.mean_, mean)
+        np.testing.assert_allclose(detector.covariance_, covariance)
+        np.testing.assert_allclose(detector.ess_, ess)
+        regularised = covariance + detector.reg_covar * np.eye(3)
+        np.testing.assert_allclose(detector.precision_,
+                                   np.linalg.inv(regularised))
+
+    def test_update_matches_recompute(self):
+        self.assert_state(self.stream(1.0),
+                          *self.recompute(np.ones(len(self.values))))
+
+    def test_forgetting_matches_weighted_recompute(self):
+        ff = 0.9
+        # every row is discounted once for each batch after its own
+        batch_index = np.searchsorted(self.splits, np.arange(500),
+                                      side='right')
+        weights = ff ** (len(self.splits) - batch_index)
+        self.assert_state(self.stream(ff), *self.recompute(weights))
+
+    def test_incomplete_rows_are_left_out(self):
+        with_gaps = self.values.copy()
+        with_gaps[[3, 250, 420], [0, 2, 1]] = np.nan
+        complete = ~np.isnan(with_gaps).any(axis=1)
+        detector = Mahalanobis()
+        detector.fit(with_gaps[:300])
+        detector.update(with_gaps[300:])
+        detector.update(np.full((2, 3), np.nan))
+        self.values = self.values[complete]
+        self.assert_state(detector,
+                          *self.recompute(np.ones(complete.sum())))
+
+
+
+class PercentileSketch1DTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(6)
+        # both signs, over several orders of magnitude
+        self.values = rng.choice([-1., 1.], size=(2000, 2)) * \
+            rng.lognormal(0., 2., size=(2000, 2))
+        self.probe = np.concatenate([np.quantile(self.values, q, axis=0)
+                                     for q in np.linspace(0, 1, 41)[:, None]])
+
+    def test_merge_equals_fitting_on_everything(self):
+        whole, first, second = (PercentileSketch1D() for _ in range(3))
+        whole.fit(self.values)
+        first.fit(self.values[:700])
+        second.fit(self.values[700:])
+        first.merge(second)
+        np.testing.assert_array_equal(first.counts_, whole.counts_)
+        np.testing.assert_array_equal(first.score_anomaly(self.probe),
+                                      whole.score_anomaly(self.probe))
+
+    def test_merge_needs_the_same_parameters(self):
+        sketch, other = PercentileSketch1D(), PercentileSketch1D(
+            relative_accuracy=0.05)
+        sketch.fit(self.values)
+        other.fit(self.values)
+        with self.assertRaises(ValueError):
+            sketch.merge(other)
+
+    def test_ranks_within_relative_accuracy(self):
+        for relative_accuracy in [0.01, 0.05]:
+            sketch = PercentileSketch1D(relative_accuracy=relative_accuracy)
+            sketch.fit(self.values[:1000])
+            sketch.update(self.values[1000:])
+            ranks = sketch.score_anomaly(self.probe)
+            # a value is only known to within its bucket, which spans a
+            # factor of gamma, so its rank is between the exact ranks of
+            # the edges of the bucket
+            gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+            low = np.minimum(self.probe / gamma, self.probe * gamma)
+            high = np.maximum(self.probe / gamma, self.probe * gamma)
+            for i in range(2):
+                column = np.sort(self.values[:, i])
+                below = np.searchsorted(column, low[:, i], side='left')
+                up_to = np.searchsorted(column, high[:, i], side='right')
+                self.assertTrue(np.all(below / len(column) <= ranks[:, i]))
+                self.assertTrue(np.all(ranks[:, i] <= up_to / len(column)))
+
+
+if __name__ == '__main__':
+    unittest.main()
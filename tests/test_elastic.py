@@ -0,0 +1,147 @@
+""" BulkWriter against a fake Elasticsearch bulk endpoint """
+
+import json
+import threading
+import unittest
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import numpy as np
+import pandas as pd
+
+from dsio.restream.elastic import (
+    BulkWriter, init_elasticsearch, serialize_dataframe
+)
+
+
+class FakeBulkHandler(BaseHTTPRequestHandler):
+    """ Answers GET / like Elasticsearch 7 and POST /_bulk with the next
+        scripted reply of the server: 'reject' fails the whole request with
+        429, a list of statuses answers one per document, and once the
+        script runs out every document is accepted """
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self.reply(200, {'version': {'number': '7.17.0',
+                                     'build_flavor': 'default'},
+                         'tagline': 'You Know, for Search'})
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        lines = self.rfile.read(length).decode().splitlines()
+        docs = [json.loads(line) for line in lines[1::2]]
+        server = self.server
+        with server.lock:
+            server.requests.append(docs)
+            script = server.script.pop(0) if server.script else None
+        if script == 'reject':
+            self.reply(429, {'error': 'es_rejected_execution_exception',
+                             'status': 429})
+            return
+        statuses = script or [201] * len(docs)
+        with server.lock:
+            server.indexed.extend(
+                doc for doc, status in zip(docs, statuses) if status == 201
+            )
+        self.reply(200, {'took': 1, 'errors': any(s != 201 for s in statuses),
+                         'items': [{'index': {'status': status}}
+                                   for status in statuses]})
+
+
+class BulkWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), FakeBulkHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.indexed = []
+        self.server.script = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.es_conn = init_elasticsearch(
+            'http://127.0.0.1:%d' % self.server.server_address[1]
+        )
+        self.dataframe = pd.DataFrame({'time': [1000, 2000, 3000],
+                                       'value': [1.0, 2.0, 3.0]})
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def write(self, **kwargs):
+        writer = BulkWriter(self.es_conn, 'test', 'measurement', workers=1,
+                            initial_backoff=0.01, **kwargs)
+        writer.write(self.dataframe)
+        writer.close()
+        return writer.stats()
+
+    def test_retries_rejected_request_and_documents(self):
+        self.server.script = ['reject', [429, 201, 429]]
+        stats = self.write()
+
+        self.assertEqual([len(docs) for docs in self.server.requests],
+                         [3, 3, 2])
+        # only the documents rejected with 429 are sent again
+        self.assertEqual([doc['time'] for doc in self.server.requests[2]],
+                         [1000, 3000])
+        self.assertEqual(sorted(doc['time'] for doc in self.server.indexed),
+                         [1000, 2000, 3000])
+        self.assertEqual(stats['docs'], 3)
+        self.assertEqual(stats['retries'], 2)
+        self.assertEqual(stats['failed_docs'], 0)
+
+    def test_counts_documents_that_run_out_of_retries(self):
+        self.server.script = [[429, 201, 400], [429], [429]]
+        stats = self.write(max_retries=2)
+
+        self.assertEqual([len(docs) for docs in self.server.requests],
+                         [3, 1, 1])
+        self.assertEqual(stats['docs'], 1)
+        self.assertEqual(stats['retries'], 2)
+        self.assertEqual(stats['failed_docs'], 2)
+
+    def test_gives_up_on_rejected_request_after_max_retries(self):
+        self.server.script = ['reject'] * 3
+        stats = self.write(max_retries=2)
+
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(stats['docs'], 0)
+        self.assertEqual(stats['failed_docs'], 3)
+
+
+class SerializeDataframeTest(unittest.TestCase):
+
+    def test_documents_match_json_dumps(self):
+        rng = np.random.default_rng(0)
+        dataframe = pd.DataFrame({
+            'time': 1500000000000 + np.arange(50, dtype=np.int64),
+            'value': rng.normal(size=50) * 1e-3,
+            'SCORE_value': rng.uniform(size=50),
+            'FLAG_value': rng.uniform(size=50) > 0.5,
+            'label': ['sensor "%d"' % i for i in range(50)],
+        })
+        dataframe.loc[3, 'value'] = np.nan
+        dataframe.loc[4, 'value'] = 0.1 + 0.2
+        docs = serialize_dataframe(dataframe)
+
+        expected = dataframe.fillna(0).to_dict(orient='records')
+        self.assertEqual(len(docs), len(expected))
+        for doc, row in zip(docs, expected):
+            # floats parse back to the very same doubles
+            self.assertEqual(json.loads(doc), row)
+        self.assertIn('"value":0.30000000000000004', docs[4])
+        self.assertIn('"value":0', docs[3])
+
+
+if __name__ == '__main__':
+    unittest.main()
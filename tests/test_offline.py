@@ -0,0 +1,130 @@
+""" Headless scoring output read back from disk """
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+import pyarrow.feather
+import pyarrow.parquet
+
+from dsio.anomaly_detectors import Gaussian1D
+from dsio.offline import NpyAppender, NpyWriter, open_writer, score_file
+
+
+class OfflineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        self.sensors = ['a', 'b']
+        self.batches = []
+        for start, stop in [(0, 5), (5, 6), (6, 13)]:
+            batch = pd.DataFrame(rng.normal(size=(stop - start, 2)),
+                                 columns=self.sensors)
+            batch.insert(0, 'time', np.arange(start, stop) + 1000)
+            scores = rng.uniform(size=(stop - start, 2))
+            self.batches.append((batch, scores, scores > 0.8))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def expected(self):
+        batch = pd.concat([batch for batch, _, _ in self.batches])
+        scores = np.vstack([scores for _, scores, _ in self.batches])
+        flags = np.vstack([flags for _, _, flags in self.batches])
+        return batch, scores, flags
+
+    def write(self, writer):
+        for batch, scores, flags in self.batches:
+            writer.write(batch, scores, flags)
+        writer.close()
+
+    def test_npy_appender(self):
+        rows = np.arange(12.).reshape(6, 2)
+        appender = NpyAppender(self.path('rows.npy'), np.float64, 2)
+        appender.append(rows[:1])
+        appender.append(rows[1:4])
+        appender.append(rows[4:])
+        appender.close()
+        loaded = np.load(self.path('rows.npy'), mmap_mode='r')
+        self.assertIsInstance(loaded, np.memmap)
+        np.testing.assert_array_equal(loaded, rows)
+
+        appender = NpyAppender(self.path('time.npy'), np.int64, None)
+        appender.append(np.arange(3))
+        appender.append(np.arange(3, 7))
+        appender.close()
+        loaded = np.load(self.path('time.npy'))
+        self.assertEqual(loaded.dtype, np.int64)
+        np.testing.assert_array_equal(loaded, np.arange(7))
+
+    def test_empty_npy_appender(self):
+        NpyAppender(self.path('rows.npy'), np.bool_, 3).close()
+        loaded = np.load(self.path('rows.npy'))
+        self.assertEqual(loaded.shape, (0, 3))
+        self.assertEqual(loaded.dtype, np.bool_)
+
+    def test_npy_writer(self):
+        writer = open_writer(self.path('out'), 'time', self.sensors)
+        self.assertIsInstance(writer, NpyWriter)
+        self.write(writer)
+        batch, scores, flags = self.expected()
+        with open(self.path('out/sensors.json')) as sensors_file:
+            self.assertEqual(json.load(sensors_file), self.sensors)
+        np.testing.assert_array_equal(
+            np.load(self.path('out/time.npy'), mmap_mode='r'),
+            batch['time'].values)
+        np.testing.assert_array_equal(
+            np.load(self.path('out/values.npy'), mmap_mode='r'),
+            batch[self.sensors].values)
+        np.testing.assert_array_equal(
+            np.load(self.path('out/scores.npy'), mmap_mode='r'), scores)
+        np.testing.assert_array_equal(
+            np.load(self.path('out/flags.npy'), mmap_mode='r'), flags)
+
+    def assert_table(self, table):
+        batch, scores, flags = self.expected()
+        self.assertEqual(table.column_names,
+                         ['time', 'a', 'b', 'SCORE_a', 'SCORE_b',
+                          'FLAG_a', 'FLAG_b'])
+        frame = table.to_pandas()
+        np.testing.assert_array_equal(frame['time'], batch['time'])
+        np.testing.assert_array_equal(frame[self.sensors],
+                                      batch[self.sensors])
+        np.testing.assert_array_equal(frame[['SCORE_a', 'SCORE_b']], scores)
+        np.testing.assert_array_equal(frame[['FLAG_a', 'FLAG_b']], flags)
+
+    def test_parquet_writer(self):
+        self.write(open_writer(self.path('out.parquet'), 'time',
+                               self.sensors))
+        parquet_file = pyarrow.parquet.ParquetFile(self.path('out.parquet'))
+        self.assertEqual(parquet_file.num_row_groups, len(self.batches))
+        self.assert_table(parquet_file.read())
+
+    def test_arrow_writer(self):
+        for name in ['out.arrow', 'out.feather']:
+            self.write(open_writer(self.path(name), 'time', self.sensors))
+            self.assert_table(pyarrow.feather.read_table(self.path(name)))
+
+    def test_score_file(self):
+        self.expected()[0].to_csv(self.path('in.csv'), index=False)
+        batch = pd.read_csv(self.path('in.csv'))
+        n_rows, _ = score_file(self.path('in.csv'), self.path('out.parquet'),
+                               Gaussian1D, timefield='time', batch_size=4)
+        self.assertEqual(n_rows, batch.shape[0])
+        frame = pyarrow.parquet.read_table(self.path('out.parquet')).to_pandas()
+        np.testing.assert_array_equal(frame[self.sensors],
+                                      batch[self.sensors])
+        self.assertTrue(np.isfinite(frame[['SCORE_a', 'SCORE_b']].values)
+                        .all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+""" Sharded scoring against scoring in a single process """
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from dsio.anomaly_detectors import (
+    Gaussian1D, Percentile1D, PercentileSketch1D, LOF1D
+)
+from dsio.helpers import init_detector_models, load_detector
+
+DETECTOR_MODULE = '''
+import numpy as np
+from sklearn.base import BaseEstimator
+from dsio.anomaly_detectors import AnomalyMixin
+
+
+class LargestSoFar(BaseEstimator, AnomalyMixin):
+    def fit(self, x):
+        self.max_ = np.max(x)
+
+    def update(self, x):
+        self.max_ = max(self.max_, np.max(x))
+
+    def score_anomaly(self, x):
+        return np.asarray(x) / self.max_
+
+    def flag_anomaly(self, x):
+        return np.asarray(x) > self.max_
+'''
+
+
+class ShardedDetectorTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # modules loaded with load_detector are loaded again by every worker
+        # started later on, so the one written here outlives the tests
+        cls.directory = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def assert_same_as_single_process(self, detector, n_sensors=5, n_jobs=2):
+        sensors = ['sensor_%d' % i for i in range(n_sensors)]
+        values = np.random.default_rng(0).normal(size=(700, n_sensors))
+        single = init_detector_models(sensors, values[:300], detector)
+        sharded = init_detector_models(sensors, values[:300], detector,
+                                       n_jobs=n_jobs)
+        try:
+            # the second batch outgrows the shared memory of the first
+            for batch in [values[300:400], values[400:2000]]:
+                # columns summed in another memory order may differ in the
+                # last bit
+                expected_scores, expected_flags = single.score_and_flag(batch)
+                scores, flags = sharded.score_and_flag(batch)
+                np.testing.assert_allclose(scores, expected_scores,
+                                           rtol=1e-12)
+                np.testing.assert_array_equal(flags, expected_flags)
+                single.update(batch)
+                sharded.update(batch)
+        finally:
+            sharded.close()
+
+    def test_columnwise_detectors(self):
+        for detector in [Gaussian1D, Percentile1D, PercentileSketch1D]:
+            self.assert_same_as_single_process(detector)
+
+    def test_per_sensor_detector_with_uneven_shards(self):
+        # 5 sensors in 2 shards of 3 and 2, one instance per sensor
+        self.assert_same_as_single_process(LOF1D)
+
+    def test_detector_loaded_from_a_module(self):
+        path = os.path.join(self.directory, 'largest.py')
+        with open(path, 'w') as module:
+            module.write(DETECTOR_MODULE)
+        detector = load_detector('LargestSoFar', [path])
+        self.assert_same_as_single_process(detector, n_jobs=3)
+
+
+if __name__ == '__main__':
+    unittest.main()
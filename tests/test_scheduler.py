@@ -0,0 +1,47 @@
+""" Splitting batches into replay windows """
+
+import unittest
+
+import numpy as np
+
+from dsio.restream.scheduler import replay_windows
+
+
+class ReplayWindowsTest(unittest.TestCase):
+
+    def check_windows(self, timestamps, interval):
+        """ Every row is replayed once, in the window its timestamp is in,
+            and the windows follow each other """
+        timestamps = np.asarray(timestamps)
+        windows = list(replay_windows(timestamps, interval))
+        replayed = np.concatenate([np.arange(len(timestamps))[rows]
+                                   for _, _, rows in windows])
+        np.testing.assert_array_equal(np.sort(replayed),
+                                      np.arange(len(timestamps)))
+        for start, end, rows in windows:
+            self.assertEqual(end - start, interval)
+            self.assertTrue(np.all((timestamps[rows] >= start) &
+                                   (timestamps[rows] < end)))
+        for (_, end, _), (start, _, _) in zip(windows, windows[1:]):
+            self.assertEqual(end, start)
+        return windows
+
+    def test_sorted_timestamps_give_slices(self):
+        windows = self.check_windows([1000, 1500, 3000, 3000, 7999], 2000)
+        self.assertEqual([rows for _, _, rows in windows],
+                         [slice(0, 2), slice(2, 4), slice(4, 4),
+                          slice(4, 5)])
+
+    def test_out_of_order_timestamps(self):
+        timestamps = np.random.default_rng(0).integers(0, 10000, 200)
+        self.check_windows(timestamps, 1000)
+
+    def test_last_timestamp_before_the_first(self):
+        windows = self.check_windows([5000, 1000, 3000, 1000], 1000)
+        # rows are in time order, ties in their order in the batch
+        np.testing.assert_array_equal(windows[0][2], [1, 3])
+        self.assertEqual(windows[0][0], 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+""" Live sources fed through pipes, sockets and a growing file """
+
+import itertools
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from unittest import mock
+
+from dsio.exceptions import InputSourceError
+from dsio.sources import open_source
+
+CSV_LINES = ['time,a,b\n', '1000,1.5,2\n', '2000,2.5,3\n', '3000,3.5,4\n',
+             '4000,4.5,5\n', '5000,5.5,6\n']
+JSON_LINES = ['{"time": %d, "a": %d}\n' % (1000 * i, i) for i in range(5)]
+
+
+def serve_lines(server, lines):
+    """ Accept one connection on a listening socket, send it lines and
+        close it """
+    def serve():
+        connection, _ = server.accept()
+        with connection:
+            connection.sendall(''.join(lines).encode())
+        server.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+
+
+class LiveSourcesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assert_batches(self, batches, columns, sizes, first_times):
+        self.assertEqual([len(batch) for batch in batches], sizes)
+        self.assertEqual([batch['time'].iloc[0] for batch in batches],
+                         first_times)
+        for batch in batches:
+            self.assertEqual(list(batch.columns), columns)
+
+    def test_csv_from_stdin(self):
+        read_fd, write_fd = os.pipe()
+        with os.fdopen(write_fd, 'w') as writer:
+            writer.writelines(CSV_LINES)
+        with os.fdopen(read_fd) as stdin, mock.patch('sys.stdin', stdin):
+            batches = list(open_source('-', batch_size=2, max_wait=5))
+        # the header goes with the first batch and isn't a row
+        self.assert_batches(batches, ['time', 'a', 'b'], [1, 2, 2],
+                            [1000, 2000, 4000])
+        self.assertEqual(batches[1]['a'].tolist(), [2.5, 3.5])
+
+    def test_batch_is_emitted_after_max_wait(self):
+        read_fd, write_fd = os.pipe()
+        writer = os.fdopen(write_fd, 'w')
+        writer.writelines(CSV_LINES[:3])
+        writer.flush()
+        with os.fdopen(read_fd) as stdin, mock.patch('sys.stdin', stdin):
+            batches = open_source('-', batch_size=100, max_wait=0.2)
+            start = time.time()
+            first = next(batches)
+            self.assertLess(time.time() - start, 5)
+            writer.writelines(CSV_LINES[3:])
+            writer.close()
+            self.assert_batches([first] + list(batches), ['time', 'a', 'b'],
+                                [2, 3], [1000, 3000])
+
+    def test_json_from_tcp(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        serve_lines(server, JSON_LINES)
+        batches = list(open_source(
+            'tcp://127.0.0.1:%d' % server.getsockname()[1], fmt='json',
+            batch_size=3, max_wait=5
+        ))
+        self.assert_batches(batches, ['time', 'a'], [3, 2], [0, 3000])
+        self.assertEqual(batches[1]['a'].tolist(), [3, 4])
+
+    @unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'needs Unix sockets')
+    def test_csv_from_unix_socket(self):
+        path = os.path.join(self.directory, 'source.sock')
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen(1)
+        serve_lines(server, CSV_LINES)
+        batches = list(open_source('unix://' + path, batch_size=10,
+                                   max_wait=5))
+        self.assert_batches(batches, ['time', 'a', 'b'], [5], [1000])
+
+    def test_follow_a_growing_file(self):
+        path = os.path.join(self.directory, 'growing.jsonl')
+        with open(path, 'w') as growing:
+            growing.writelines(JSON_LINES[:2])
+
+        def append():
+            time.sleep(0.2)
+            with open(path, 'a') as growing:
+                growing.write(JSON_LINES[2][:5]) # a record split mid-line
+                growing.flush()
+                time.sleep(0.2)
+                growing.write(JSON_LINES[2][5:])
+                growing.writelines(JSON_LINES[3:])
+
+        threading.Thread(target=append, daemon=True).start()
+        batches = open_source(path, batch_size=2, max_wait=1, follow=True)
+        # a followed file never ends, so take the batches that are due
+        batches = list(itertools.islice(batches, 3))
+        self.assert_batches(batches, ['time', 'a'], [2, 2, 1],
+                            [0, 2000, 4000])
+
+    def test_unreachable_socket(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        port = server.getsockname()[1]
+        server.close()
+        with self.assertRaises(InputSourceError):
+            open_source('tcp://127.0.0.1:%d' % port)
+
+
+if __name__ == '__main__':
+    unittest.main()
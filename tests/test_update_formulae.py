@@ -0,0 +1,130 @@
+""" Sliding-window helpers against their straightforward equivalents """
+
+import unittest
+
+import numpy as np
+
+from dsio.update_formulae import (
+    RollingWindow,
+    sorted_window_update,
+    update_mean_variance
+)
+
+
+class UpdateMeanVarianceTest(unittest.TestCase):
+
+    def test_missing_values_match_the_complete_ones(self):
+        values = np.random.default_rng(0).normal(size=(60, 2))
+        values[::7, 0] = np.nan
+        mean, variance, ess = np.zeros(2), np.ones(2), 1
+        for batch in np.split(values, [5, 6, 30]):
+            mean, variance, ess = update_mean_variance(mean, variance, ess,
+                                                       batch)
+        for i in range(2):
+            column = values[:, i][~np.isnan(values[:, i])]
+            expected = update_mean_variance(0., 1., 1, column)
+            np.testing.assert_allclose([mean[i], variance[i], ess[i]],
+                                       expected)
+
+    def test_column_without_history_starts_from_the_batch(self):
+        # a sensor that was all NaN so far, then gets values
+        mean, variance, ess = np.array([1., np.nan]), np.array([1., np.nan]), \
+            np.array([3, 0])
+        mean, variance, ess = update_mean_variance(
+            mean, variance, ess, [[1., np.nan], [1., np.nan]])
+        self.assertTrue(np.isnan(mean[1]))
+        self.assertEqual(ess[1], 0)
+
+        mean, variance, ess = update_mean_variance(
+            mean, variance, ess, [[1., 2.], [1., 4.], [1., np.nan]])
+        np.testing.assert_allclose(mean, [1., 3.])
+        np.testing.assert_allclose(variance, [.375, 1.])
+        np.testing.assert_allclose(ess, [8., 2.])
+
+
+class SortedWindowUpdateTest(unittest.TestCase):
+
+    def slide(self, values, window_size, batch_sizes):
+        """ Slide a window over values with sorted_window_update, checking
+            it against sorting the window again after every batch """
+        sorted_window = np.sort(values[:window_size], axis=0)
+        start = 0
+        for batch_size in batch_sizes:
+            stop = start + window_size
+            evicted = values[start:start + batch_size]
+            new = values[stop:stop + batch_size]
+            sorted_window = sorted_window_update(sorted_window, evicted, new)
+            start += batch_size
+            np.testing.assert_array_equal(
+                sorted_window,
+                np.sort(values[start:start + window_size], axis=0)
+            )
+
+    def test_1d(self):
+        values = np.random.default_rng(0).normal(size=300)
+        self.slide(values, 40, [1, 5, 39, 40, 3, 20])
+
+    def test_1d_with_duplicates(self):
+        values = np.random.default_rng(1).integers(0, 5, 300).astype(float)
+        self.slide(values, 40, [1, 5, 39, 40, 3, 20])
+
+    def test_2d_columns_sorted_independently(self):
+        values = np.random.default_rng(2).integers(0, 6, (300, 3)).astype(float)
+        self.slide(values, 40, [1, 5, 39, 40, 3, 20])
+
+    def test_evictions_and_insertions_of_different_sizes(self):
+        sorted_old = np.array([1., 2., 2., 5.])
+        np.testing.assert_array_equal(
+            sorted_window_update(sorted_old, [2.], [0., 2., 7.]),
+            [0., 1., 2., 2., 5., 7.]
+        )
+        np.testing.assert_array_equal(
+            sorted_window_update(sorted_old, [5., 1., 2.], []), [2.]
+        )
+
+
+class RollingWindowTest(unittest.TestCase):
+
+    def check_stream(self, size, batch_sizes, n_columns=None):
+        """ Append batches to a window, checking it and the datapoints it
+            evicts against slicing the whole stream """
+        shape = (sum(batch_sizes),) if n_columns is None else \
+            (sum(batch_sizes), n_columns)
+        values = np.arange(np.prod(shape), dtype=float).reshape(shape)
+        window = RollingWindow(size, n_columns)
+        start = 0
+        for batch_size in batch_sizes:
+            stop = start + batch_size
+            evicted = window.append(values[start:stop])
+            first = max(stop - size, 0)
+            # only datapoints that were in the window are evicted, not the
+            # start of a batch bigger than the window
+            np.testing.assert_array_equal(
+                evicted, values[max(start - size, 0):min(first, start)]
+            )
+            np.testing.assert_array_equal(np.asarray(window),
+                                          values[first:stop])
+            np.testing.assert_array_equal(np.concatenate(window.views()),
+                                          values[first:stop])
+            self.assertEqual(len(window), stop - first)
+            start = stop
+
+    def test_wraparound(self):
+        # batches that end exactly at, and straddle, the end of the buffer
+        self.check_stream(5, [3, 2, 1, 3, 4, 2, 5, 1])
+
+    def test_batches_at_least_as_big_as_the_window(self):
+        self.check_stream(5, [2, 5, 1, 8, 3, 6])
+
+    def test_wraparound_with_columns(self):
+        self.check_stream(4, [3, 3, 2, 1, 5, 3], n_columns=3)
+
+    def test_from_array_keeps_the_latest_rows(self):
+        window = RollingWindow.from_array(np.arange(7.), 4)
+        np.testing.assert_array_equal(np.asarray(window), [3., 4., 5., 6.])
+        np.testing.assert_array_equal(window.append([7., 8.]), [3., 4.])
+        np.testing.assert_array_equal(np.asarray(window), [5., 6., 7., 8.])
+
+
+if __name__ == '__main__':
+    unittest.main()